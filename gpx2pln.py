@@ -1,48 +1,91 @@
 import argparse
 import os
 import glob
-import multiprocessing
-import matplotlib.pyplot as plt
+import gpx2pln_convert
+import gpx2pln_profile
 
-from gpx2pln_gpx import GpxFile, GpxConcat
-from gpx2pln_pln import PlnFile
-from gpx2pln_airports import AirportDatabase
-
-import gpx2pln_subsample
-import gpx2pln_douglas_peucker
+# HINT: everything else is imported in the stage that needs it. numpy, scipy and especially matplotlib take much
+# longer to import than small jobs take to run, and worker processes on windows import this module again.
+# gpx2pln_check_startup.py makes sure that it stays this way.
 
 # only for debugging. coordinates can be copy-pasted into microsoft flight simulator.
-def _debug_print_leg(coords):
-    for c in coords:
-        print("%s,%s" % (c.lat,c.lon))
-
-# worker function for reading/processing gpx files in multiple processes
-def _worker_gpx_fname_to_obj(fname):
-    obj = GpxFile(fname)
-    if len(obj) > 0:
-        return obj
-    return None
-
-def _plot_gpx_and_pln(gpx_track, pln_legs, fname):
-    # convert gpx to two lists
-    gpx_track = [(float(x.lat), float(x.lon)) for x in gpx_track]
-    gpx_lat, gpx_lon = zip(*gpx_track)
-    
-    # plot the gpx track as dots
-    plt.plot(gpx_lon, gpx_lat, color="gray", marker=".", linestyle="none")
-
-    # plot the pln legs
-    for i in range(len(pln_legs)):
-        # convert the leg to two lists
-        pln_track = [(float(x.lat), float(x.lon)) for x in pln_legs[i]]
-        pln_lat, pln_lon = zip(*pln_track)
-
-        # plot the pln leg as lines
-        pln_color = "blue" if (i % 2) == 0 else "green"
-        plt.plot(pln_lon, pln_lat, color=pln_color, marker="o", linestyle="-")
-
-    # save to file
-    plt.savefig(fname, dpi=300)
+def _debug_print_leg(track):
+    for lat, lon in zip(track.get_lats(), track.get_lons()):
+        print("%s,%s" % (lat,lon))
+
+# settings of one route: the gpx files to read and how to convert them. the command line arguments are the defaults.
+def _make_route(args, gpx_globs, base_dir=None, **settings):
+    route = {
+        "pln_stem": args.pln_stem,
+        "max_leg_length": args.max_leg_length,
+        "num_leg_points": args.num_leg_points,
+        "algorithm": args.algorithm,
+        "tolerance": args.tolerance,
+        "smooth": args.smooth,
+        "reverse": args.reverse,
+        "auto_order": args.auto_order
+    }
+    for key, value in settings.items():
+        if not key in route:
+            raise ValueError("Unknown setting '%s' in the manifest." % key)
+        route[key] = value
+
+    # paths in a manifest are relative to the manifest
+    if type(gpx_globs) == str:
+        gpx_globs = [gpx_globs]
+    if not base_dir is None:
+        gpx_globs = [os.path.join(base_dir, x) for x in gpx_globs]
+        if not route["pln_stem"] is None:
+            route["pln_stem"] = os.path.join(base_dir, route["pln_stem"])
+
+    # expand the globs
+    gpx_fnames = list()
+    for val in gpx_globs:
+        gpx_fnames += sorted(glob.glob(val))
+    if len(gpx_fnames) == 0:
+        raise ValueError("No GPX files found for %s." % ", ".join(gpx_globs))
+    return gpx2pln_convert.make_route(gpx_fnames, **route)
+
+# routes listed in a json manifest. every entry has the gpx globs in "gpx" and optionally the same settings as the
+# command line, e.g. {"gpx": ["PCT/ca_*.gpx"], "pln_stem": "pct", "max_leg_length": 300, "reverse": true}.
+def _read_manifest(fname, args):
+    import json
+    with open(fname, "r") as fd:
+        entries = json.load(fd)
+    if type(entries) != list or not all(type(x) == dict for x in entries):
+        raise ValueError("The manifest has to be a list of routes.")
+    base_dir = os.path.dirname(os.path.abspath(fname))
+    routes = list()
+    for entry in entries:
+        gpx_globs = entry.pop("gpx", None)
+        if gpx_globs is None:
+            raise ValueError("Every route in the manifest needs its GPX files in 'gpx'.")
+        routes.append(_make_route(args, gpx_globs, base_dir, **entry))
+    if len(set(x["pln_stem"] for x in routes)) != len(routes):
+        raise ValueError("The PLN stems in the manifest have to be unique.")
+    return routes
+
+# write the profile of a run as json
+def _write_profile(fname, profile, wall_seconds, cpu_seconds, num_points, num_legs):
+    import datetime
+    import json
+    import platform
+    import sys
+    report = {
+        "command_line": sys.argv,
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": sys.version,
+        "platform": platform.platform(),
+        "num_points": num_points,
+        "num_legs": num_legs,
+        "wall_seconds": wall_seconds,
+        "cpu_seconds": cpu_seconds,
+        "peak_rss_bytes": gpx2pln_profile.peak_rss(),
+        "counters": gpx2pln_profile.get_counters(),
+        "stages": profile.get_stages()
+    }
+    with open(fname, "w") as fd:
+        json.dump(report, fd, indent=2)
 
 def main():
     # parse command line arguments
@@ -50,84 +93,91 @@ def main():
     parser.add_argument("--pln_stem", type=str, default=None, help="Stem for generating paths to the PLN files to write.")
     parser.add_argument("--max_leg_length", type=int, default=500, help="Maximum length of one leg in miles.")
     parser.add_argument("--num_leg_points", type=int, default=5, help="Number of waypoints per leg, departure and arrival inclusive.")
-    parser.add_argument("--algorithm", type=str, default="douglas-peucker", help="Algorithm for choosing waypoints. Values: 'subsample', 'douglas-peucker'.")
+    parser.add_argument("--algorithm", type=str, default="douglas-peucker", help="Algorithm for choosing waypoints. Values: 'subsample', 'douglas-peucker', 'visvalingam'.")
+    parser.add_argument("--tolerance", type=float, default=None, help="Maximum distance in kilometers between the GPX track and the flight plan for 'douglas-peucker'. Defaults to 10 kilometers.")
+    parser.add_argument("--smooth", action="store_true", help="Smooth the GPX track before choosing waypoints with 'douglas-peucker'.")
     parser.add_argument("--reverse", action="store_true", help="Reverse the flight plan.")
+    parser.add_argument("--auto_order", action="store_true", help="Order and orient the GPX files by their start and end points instead of using them in the given order, e.g. for sections with scrambled names.")
+    parser.add_argument("--jobs", type=int, default=None, help="Number of processes for reading GPX files and writing PLN files. Defaults to the number of CPUs.")
+    parser.add_argument("--no_cache", action="store_true", help="Do not use the cache of parsed GPX files.")
+    parser.add_argument("--no_plot", action="store_true", help="Do not plot the GPX track and the flight plan.")
+    parser.add_argument("--raster_plot", action="store_true", help="Plot the GPX track as a raster instead of one dot per point. Much faster for long tracks.")
     parser.add_argument("--reset_airports", action="store_true", help="Reset the airports database.")
-    parser.add_argument("gpx_fnames", type=str, nargs="+", help="Paths to the GPX files to read.")
+    parser.add_argument("--airport_sources", type=str, default=None, help="Local directory or URL of a mirror with the airports.json of mwgg and the airports.csv of ourairports.com for building the airports database. Defaults to downloading them.")
+    parser.add_argument("--profile", type=str, default=None, help="Path to a JSON file to write the time, memory and counted operations of every stage to.")
+    parser.add_argument("--profile_stats", type=str, default=None, help="Path to a file to write cProfile statistics of the main process to, readable with pstats. Use '--jobs 1' to include all the work.")
+    parser.add_argument("--out_of_core", action="store_true", help="Never keep a whole track in memory, for tracks with tens of millions of points. The tracks are kept in memory-mapped files, PLN files are written as soon as their leg is complete and the plot is always a raster. Every GPX file is still read as a whole, so the memory grows with the largest file. Does not support '--smooth'.")
+    parser.add_argument("--scratch_dir", type=str, default=None, help="Directory for the memory-mapped files of '--out_of_core'. Defaults to the temporary directory.")
+    parser.add_argument("--chunk_size", type=int, default=gpx2pln_convert.DEFAULT_CHUNK_SIZE, help="Number of points processed at once with '--out_of_core'.")
+    parser.add_argument("--incremental", action="store_true", help="Keep the state of the conversion next to the PLN files and only plan the legs again that overlap GPX files which changed since the last run. Does not support '--smooth'.")
+    parser.add_argument("--manifest", type=str, default=None, help="Path to a JSON manifest with many routes to convert at once. The other parameters are the defaults for all routes.")
+    parser.add_argument("gpx_fnames", type=str, nargs="*", help="Paths to the GPX files to read.")
     args = parser.parse_args()
-
-    # sanity checks
-    assert args.max_leg_length is None or args.max_leg_length > 0
-    assert args.num_leg_points >= 2
-    assert args.algorithm in ["subsample", "douglas-peucker"]
-
-    # path to the airports database
+    if (args.manifest is None) == (len(args.gpx_fnames) == 0):
+        parser.error("either GPX files or a manifest are required")
+    if args.out_of_core and args.smooth:
+        parser.error("--smooth is not supported with --out_of_core")
+    if args.incremental and (args.smooth or args.out_of_core):
+        parser.error("--incremental does not support --smooth and --out_of_core")
+    if args.chunk_size < 1:
+        parser.error("--chunk_size has to be positive")
+    if not args.jobs is None and args.jobs < 1:
+        parser.error("--jobs has to be positive")
+
+    # profile everything after parsing the arguments if requested
+    import time
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    profiler = None
+    if not args.profile_stats is None:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    profile = gpx2pln_profile.StageProfile()
+
+    # the routes to convert
+    try:
+        if args.manifest is None:
+            routes = [_make_route(args, args.gpx_fnames)]
+        else:
+            routes = _read_manifest(args.manifest, args)
+    except ValueError as error:
+        parser.error(str(error))
+
+    # path to the airports database. the binary database is stored next to it.
     airports_json = os.environ["APPDATA"] + "\\gpx2pln_airports.json"
+    airports_bin = os.environ["APPDATA"] + "\\gpx2pln_airports.bin"
 
     # delete the airports database if requested
-    if args.reset_airports and os.path.isfile(airports_json):
-        os.remove(airports_json)
-
-    # create the airport database if requested
-    airport_db = AirportDatabase(airports_json)
-
-    # convert the maximum leg length from miles to kilometres
-    max_leg_length = None if args.max_leg_length is None else args.max_leg_length * 1.609344
-
-    # pool for multi-processing
-    thread_pool = multiprocessing.Pool()
-
-    # read the gpx files
-    print("Processing the GPX file(s)... ", end="", flush=True)
-    gpx_fnames = list()
-    for val in args.gpx_fnames:
-        gpx_fnames += sorted(glob.glob(val))
-    gpx_raw = thread_pool.map(_worker_gpx_fname_to_obj, gpx_fnames)
-    gpx = [x for x in gpx_raw if not x is None]
-    gpx = GpxConcat(gpx)
-    print("done!", flush=True)
-
-    # choose a default pln stem
-    default_pln_stem = os.path.split(gpx_fnames[0])[-1][:-4]
-    pln_stem = args.pln_stem
-    if pln_stem is None:
-        pln_stem = default_pln_stem
-
-    # reverse if requested
-    if args.reverse:
-        gpx.reverse()
-
-    # choose waypoints for the flight plan
-    print("Choosing waypoints... ", end="", flush=True)
-    legs = None
-    if args.algorithm == "subsample":
-        legs = gpx2pln_subsample.subsample(gpx.get_track_coords(), max_leg_length, args.num_leg_points)
-    elif args.algorithm == "douglas-peucker":
-        legs = gpx2pln_douglas_peucker.douglas_peucker(gpx.get_track_coords(), max_leg_length)
-    else:
-        raise NotImplementedError
-    assert type(legs) == list and len(legs) > 0
-    print("done!", flush=True)
-
-    # save the legs as pln files
-    print("Writing the PLN file(s)... ", end="", flush=True)
-    for i in range(len(legs)):
-        counter = str(i+1)
-        title = gpx.get_track_name()
-        if len(title) == 0:
-            title = "Unnamed flight plan"
-        elif len(title) > 30:
-            title = title[:30] + "..."
-        title += " (" + counter + ")"
-        description = gpx.get_track_name() + " by " + gpx.get_author_name()
-        pln = PlnFile(title, description, legs[i], elevation=gpx.get_max_elevation())
-        pln.write(pln_stem + "_" + counter + ".pln", airport_db)
-    print("done!", flush=True)
-
-    # plot the result
-    print("Plotting the result... ", end="", flush=True)
-    _plot_gpx_and_pln(gpx.get_track_coords(), legs, pln_stem + ".jpg")
-    print("done!", flush=True)
+    if args.reset_airports:
+        for fname in (airports_json, airports_bin):
+            if os.path.isfile(fname):
+                os.remove(fname)
+
+    # cache of parsed gpx files
+    cache_dir = None
+    if not args.no_cache:
+        cache_dir = os.environ["APPDATA"] + "\\gpx2pln_cache"
+
+    # convert. all routes share the worker pool, the airports database and the cache.
+    converter = gpx2pln_convert.Converter(airports_json, args.jobs, cache_dir, verbose=True, airport_sources=args.airport_sources)
+    try:
+        if args.out_of_core:
+            results = converter.convert_out_of_core(routes, not args.no_plot, args.scratch_dir, args.chunk_size, profile=profile)
+        else:
+            results = converter.convert(routes, not args.no_plot, args.raster_plot, profile=profile, incremental=args.incremental)
+    except gpx2pln_convert.EmptyRouteError as error:
+        parser.exit(1, "\n%s\n" % error)
+    finally:
+        converter.close()
+
+    # write the profile if requested
+    if not profiler is None:
+        profiler.disable()
+        profiler.dump_stats(args.profile_stats)
+    if not args.profile is None:
+        _write_profile(args.profile, profile, time.perf_counter() - wall_start, time.process_time() - cpu_start, sum(x["num_points"] for x in results), sum(len(x["legs"]) for x in results))
+        print("Profile written to %s!" % args.profile)
 
 if __name__ == "__main__":
     main()
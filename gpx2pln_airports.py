@@ -1,191 +1,415 @@
-import urllib.request
 import json
 import os
 import datetime
-import LatLon23
-import csv
-import io
-import sqlite3
-
-def _add_mwgg_to_database(db):
-    mwgg_blob = urllib.request.urlopen("https://github.com/mwgg/Airports/raw/master/airports.json").read()
-    mwgg_dict = json.loads(mwgg_blob.decode("utf-8"))
-    for icao, info in mwgg_dict.items():
-        icao = str(icao).upper()
-        iata = info["iata"]
-        if type(iata) == str and len(iata) == 0:
-            iata = None
-        if type(iata) == str:
-            iata = iata.upper()
-        db[icao] = {
-            "lat": float(info["lat"]),
-            "lon": float(info["lon"]),
-            "elevation": int(info["elevation"]),
-            "name": str(info["name"]),
-            "local_code": None,
-            "iata": iata
-        }
-
-def _add_ourairports_com_to_database(db):
-    ourairports_blob = urllib.request.urlopen("https://ourairports.com/data/airports.csv").read()
-    ourairports_fd = io.StringIO(ourairports_blob.decode("utf-8"))
-    ourairports_reader = csv.DictReader(ourairports_fd, dialect="excel")
-    for info in ourairports_reader:
-        type = info["type"]
-        if type in ("closed", "heliport", "seaplane_base"):
+import numpy as np
+import struct
+import gpx2pln_geo
+import gpx2pln_profile
+import gpx2pln_spatial
+
+NUM_EXTRA_AIRPORT_CANDIDATES = 8 # looked at in addition to the requested number of nearest airports
+LNV_INITIAL_SEARCH_RADIUS = 50.0 # in kilometers
+BINARY_DATABASE_MAGIC = b"GPX2PLN\0"
+BINARY_DATABASE_VERSION = 2
+BINARY_DATABASE_ALIGNMENT = 64 # in bytes
+
+def _is_recent_file(fname):
+    # files older than two weeks are refreshed
+    if not os.path.isfile(fname):
+        return False
+    file_dtime = datetime.datetime.utcfromtimestamp(os.path.getmtime(fname))
+    cur_dtime = datetime.datetime.utcnow()
+    return (cur_dtime-file_dtime) < datetime.timedelta(weeks=2)
+
+# the sources of the airports database: the name of the file in a mirror and the upstream url
+AIRPORT_SOURCES = {
+    "mwgg": ("airports.json", "https://github.com/mwgg/Airports/raw/master/airports.json"),
+    "ourairports": ("airports.csv", "https://ourairports.com/data/airports.csv")
+}
+OURAIRPORTS_SKIPPED_TYPES = ["closed", "heliport", "seaplane_base"]
+
+# location of a source. upstream by default, otherwise the file of the same name in a local directory or below the
+# url of a mirror.
+def _source_location(sources, name):
+    fname, url = AIRPORT_SOURCES[name]
+    if sources is None:
+        return url
+    if "://" in sources:
+        return sources.rstrip("/") + "/" + fname
+    return os.path.join(sources, fname)
+
+# open a source as a binary stream, from a local file or from anything urllib can fetch
+def _open_source(location):
+    if "://" in location:
+        import urllib.request
+        return urllib.request.urlopen(location)
+    return open(location, "rb")
+
+# the sources are read into columns of typed arrays, one row per airport. strings are unicode arrays with empty
+# strings for missing values, like in the binary database.
+def _read_mwgg(fd):
+    import io
+    mwgg_dict = json.load(io.TextIOWrapper(fd, encoding="utf-8"))
+    infos = list(mwgg_dict.values())
+    return {
+        "ident": np.char.upper(np.array([str(x) for x in mwgg_dict.keys()], dtype=str)),
+        "lat": np.array([float(x["lat"]) for x in infos], dtype=np.float64),
+        "lon": np.array([float(x["lon"]) for x in infos], dtype=np.float64),
+        "elevation": np.array([int(x["elevation"]) for x in infos], dtype=np.float64),
+        "name": np.array([str(x["name"]) for x in infos], dtype=str),
+        "local_code": np.full(len(infos), "", dtype=str),
+        "iata": np.char.upper(np.array(["" if x["iata"] is None else str(x["iata"]) for x in infos], dtype=str))
+    }
+
+def _read_ourairports(fd):
+    import array
+    import csv
+    import io
+
+    # stream through the rows and only keep the columns we need
+    reader = csv.reader(io.TextIOWrapper(fd, encoding="utf-8", newline=""), dialect="excel")
+    header = next(reader)
+    type_col, ident_col, local_code_col, iata_col, ele_col, lat_col, lon_col, name_col = [header.index(x) for x in ("type", "ident", "local_code", "iata_code", "elevation_ft", "latitude_deg", "longitude_deg", "name")]
+    idents, local_codes, iatas, names = list(), list(), list(), list()
+    lats, lons, elevations = array.array("d"), array.array("d"), array.array("d")
+    for row in reader:
+        if row[type_col] in OURAIRPORTS_SKIPPED_TYPES:
             continue
-        icao = str(info["ident"]).upper()
-        local_code = str(info["local_code"]).upper()
-        iata = info["iata_code"]
-        if len(iata) == 0:
-            iata = None
+        idents.append(row[ident_col])
+        local_codes.append(row[local_code_col])
+        iatas.append(row[iata_col])
+        names.append(row[name_col])
+        lats.append(float(row[lat_col]))
+        lons.append(float(row[lon_col]))
+        elevations.append(float(row[ele_col]) if len(row[ele_col]) > 0 else np.nan)
+
+    # local codes that equal the ident are dropped
+    columns = {
+        "ident": np.char.upper(np.array(idents, dtype=str)),
+        "lat": np.frombuffer(lats, dtype=np.float64),
+        "lon": np.frombuffer(lons, dtype=np.float64),
+        "elevation": np.frombuffer(elevations, dtype=np.float64).copy(),
+        "name": np.array(names, dtype=str),
+        "local_code": np.char.upper(np.array(local_codes, dtype=str)),
+        "iata": np.char.upper(np.array(iatas, dtype=str))
+    }
+    columns["local_code"][columns["local_code"] == columns["ident"]] = ""
+    return columns
+
+def _read_source(sources, name, reader):
+    with _open_source(_source_location(sources, name)) as fd:
+        return reader(fd)
+
+# merge the rows of several sources on their idents like updating a dictionary: later rows replace earlier rows
+# with the same ident, but the airport keeps the position of its first row
+def _merge_airports(columns_list):
+    columns = {key: np.concatenate([x[key] for x in columns_list]) for key in columns_list[0]}
+    _, first = np.unique(columns["ident"], return_index=True)
+    _, last = np.unique(columns["ident"][::-1], return_index=True)
+    rows = (len(columns["ident"]) - 1 - last)[np.argsort(first, kind="stable")]
+    return {key: values[rows] for key, values in columns.items()}
+
+# fill missing iata codes and elevations from the rows of another source with the same ident. rows without
+# elevation are dropped afterwards. the idents of the other source have to be unique.
+def _fill_missing_airports(columns, other):
+    # rows of the other source with the same ident
+    order = np.argsort(other["ident"], kind="stable")
+    pos = np.searchsorted(other["ident"], columns["ident"], sorter=order)
+    found = pos < len(order)
+    other_rows = np.zeros(len(pos), dtype=np.intp)
+    other_rows[found] = order[pos[found]]
+    found[found] = other["ident"][other_rows[found]] == columns["ident"][found]
+
+    # fill in
+    iatas = columns["iata"].astype(np.result_type(columns["iata"], other["iata"]))
+    fill = found & (iatas == "")
+    iatas[fill] = other["iata"][other_rows[fill]]
+    elevations = columns["elevation"].copy()
+    fill = found & np.isnan(elevations)
+    elevations[fill] = other["elevation"][other_rows[fill]]
+    columns = dict(columns, iata=iatas, elevation=elevations)
+    keep = ~np.isnan(elevations)
+    return {key: values[keep] for key, values in columns.items()}
+
+# read and merge the sources of the airports database. both are fetched at the same time. ourairports.com is
+# preferred, mwgg fills in what it lacks.
+def _read_airport_sources(sources=None):
+    import concurrent.futures
+    with concurrent.futures.ThreadPoolExecutor(len(AIRPORT_SOURCES)) as executor:
+        mwgg = executor.submit(_read_source, sources, "mwgg", _read_mwgg)
+        ourairports = executor.submit(_read_source, sources, "ourairports", _read_ourairports)
+        mwgg = _merge_airports([mwgg.result()])
+        ourairports = ourairports.result()
+    return _merge_airports([mwgg, _fill_missing_airports(ourairports, mwgg)])
+
+# the binary database is a small json header followed by aligned columns that can be memory-mapped
+def _strings_to_table(values):
+    # offsets into one utf-8 blob. none is stored as an empty string.
+    blobs = [b"" if x is None else str(x).encode("utf-8") for x in values]
+    offsets = np.zeros(len(blobs) + 1, dtype="<i8")
+    np.cumsum([len(x) for x in blobs], out=offsets[1:])
+    return offsets, np.frombuffer(b"".join(blobs), dtype=np.uint8)
+
+def _table_to_string(offsets, blob, idx):
+    value = bytes(blob[offsets[idx]:offsets[idx+1]]).decode("utf-8")
+    return None if len(value) == 0 else value
+
+# the json database as columns
+def _database_to_airports(db):
+    idents = list(db.keys())
+    return {
+        "ident": idents,
+        "lat": [db[x]["lat"] for x in idents],
+        "lon": [db[x]["lon"] for x in idents],
+        "elevation": [int(db[x]["elevation"]) for x in idents],
+        "name": [db[x]["name"] for x in idents],
+        "local_code": [db[x]["local_code"] for x in idents],
+        "iata": [db[x]["iata"] for x in idents]
+    }
+
+def _airports_to_columns(airports):
+    # one entry per airport in every column
+    lats = np.asarray(airports["lat"], dtype="<f8")
+    lons = np.asarray(airports["lon"], dtype="<f8")
+    columns = {
+        "lat": lats,
+        "lon": lons,
+        "elevation": np.asarray(airports["elevation"]).astype("<i8")
+    }
+    for key in ("ident", "name", "local_code", "iata"):
+        columns[key + "_offsets"], columns[key + "_blob"] = _strings_to_table(airports[key])
+    return columns
+
+def _write_binary_database(fname, columns):
+    # layout of the columns
+    layout = dict()
+    offset = 0
+    for key, values in columns.items():
+        layout[key] = [offset, values.dtype.str, list(values.shape)]
+        offset += -(-values.nbytes // BINARY_DATABASE_ALIGNMENT) * BINARY_DATABASE_ALIGNMENT
+    header = json.dumps({"version": BINARY_DATABASE_VERSION, "columns": layout}).encode("utf-8")
+    data_start = -(-(len(BINARY_DATABASE_MAGIC) + 8 + len(header)) // BINARY_DATABASE_ALIGNMENT) * BINARY_DATABASE_ALIGNMENT
+
+    # write to a temporary file first to never leave a broken database behind
+    with open(fname + ".tmp", "wb") as fd:
+        fd.write(BINARY_DATABASE_MAGIC)
+        fd.write(struct.pack("<Q", len(header)))
+        fd.write(header)
+        for key, values in columns.items():
+            fd.seek(data_start + layout[key][0])
+            fd.write(np.ascontiguousarray(values).tobytes())
+        fd.truncate()
+    os.replace(fname + ".tmp", fname)
+
+def _read_binary_database(fname):
+    # read the header. none if this is not a valid database.
+    with open(fname, "rb") as fd:
+        if fd.read(len(BINARY_DATABASE_MAGIC)) != BINARY_DATABASE_MAGIC:
+            return None
+        header_len = struct.unpack("<Q", fd.read(8))[0]
+        header = json.loads(fd.read(header_len).decode("utf-8"))
+    if header["version"] != BINARY_DATABASE_VERSION:
+        return None
+    data_start = -(-(len(BINARY_DATABASE_MAGIC) + 8 + header_len) // BINARY_DATABASE_ALIGNMENT) * BINARY_DATABASE_ALIGNMENT
+
+    # map the columns
+    columns = dict()
+    for key, (offset, dtype, shape) in header["columns"].items():
+        if np.prod(shape) == 0:
+            columns[key] = np.empty(shape, dtype=dtype)
         else:
-            iata = iata.upper()
-        if iata is None and icao in db:
-            iata = db[icao]["iata"]
-        if len(local_code) == 0 or local_code == icao:
-            local_code = None
-        ele = str(info["elevation_ft"])
-        if len(ele) == 0:
-            if icao in db:
-                ele = db[icao]["elevation"]
+            columns[key] = np.memmap(fname, dtype=dtype, mode="r", offset=data_start+offset, shape=tuple(shape))
+    return columns
+
+# answers nearest airport queries directly from the little navmap database. the airports are indexed in an
+# r*tree that is stored next to the little navmap database and rebuilt whenever little navmap updated its database.
+class _LittleNavmapIndex:
+    def __init__(self, lnv_db_fname):
+        # the r*tree lives in its own database, the little navmap database is only read
+        import sqlite3
+        import urllib.request
+        rtree_fname = os.path.splitext(lnv_db_fname)[0] + "_gpx2pln_rtree.sqlite"
+        self.__connection = sqlite3.connect(rtree_fname, check_same_thread=False)
+        lnv_uri = "file:" + urllib.request.pathname2url(os.path.abspath(lnv_db_fname)) + "?mode=ro"
+        self.__connection.execute("ATTACH DATABASE ? AS lnm", (lnv_uri,))
+
+        # is the r*tree up to date?
+        cursor = self.__connection.cursor()
+        cursor.execute("CREATE TABLE IF NOT EXISTS gpx2pln_meta (key TEXT PRIMARY KEY, value TEXT)")
+        cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS airport_rtree USING rtree(airport_id, min_lat, max_lat, min_lon, max_lon)")
+        lnv_stat = os.stat(lnv_db_fname)
+        source = "%s:%i:%i" % (os.path.abspath(lnv_db_fname), lnv_stat.st_mtime_ns, lnv_stat.st_size)
+        cursor.execute("SELECT value FROM gpx2pln_meta WHERE key = 'source'")
+        row = cursor.fetchone()
+
+        # rebuild if little navmap changed its database, e.g. after a scenery update
+        if row is None or row[0] != source:
+            print("Indexing the Little Navmap database... ", end="", flush=True)
+            cursor.execute("DELETE FROM airport_rtree")
+            cursor.execute("INSERT INTO airport_rtree SELECT airport_id, laty, laty, lonx, lonx FROM lnm.airport")
+            cursor.execute("INSERT OR REPLACE INTO gpx2pln_meta VALUES ('source', ?)", (source,))
+            self.__connection.commit()
+            print("done!", flush=True)
+
+        # number of airports
+        cursor.execute("SELECT COUNT(*) FROM airport_rtree")
+        self.__numAirports = cursor.fetchone()[0]
+        assert self.__numAirports > 0
+
+    def __len__(self):
+        return self.__numAirports
+
+    def __find_in_box(self, box):
+        min_lat, max_lat, min_lon, max_lon = box
+        cursor = self.__connection.execute(
+            "SELECT a.ident, a.laty, a.lonx, a.altitude, a.name FROM airport_rtree AS r JOIN lnm.airport AS a ON a.airport_id = r.airport_id "
+            "WHERE r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ?",
+            (min_lat, max_lat, min_lon, max_lon))
+        return [(str(x[0]).upper(), float(x[1]), float(x[2]), int(x[3]), str(x[4])) for x in cursor]
+
+    def find_nearest(self, lat, lon, k):
+        # grow the search radius until the k nearest airports are known for sure
+        radius = LNV_INITIAL_SEARCH_RADIUS
+        while True:
+            cands = list()
+            for box in gpx2pln_spatial.bounding_boxes(lat, lon, radius):
+                cands.extend(self.__find_in_box(box))
+            gpx2pln_profile.count("airport_candidates", len(cands))
+
+            # exact distances to the candidates
+            if len(cands) >= k:
+                dists = np.atleast_1d(gpx2pln_geo.distance(lat, lon, [x[1] for x in cands], [x[2] for x in cands]))
+                order = np.argsort(dists, kind="stable")[:k]
+
+                # everything within the radius has been found
+                max_dist = dists[order[-1]]
+                if max_dist <= radius or len(cands) >= len(self):
+                    return [cands[i] for i in order]
+                radius = max_dist
             else:
-                continue
-        db[icao] = {
-            "lat": float(info["latitude_deg"]),
-            "lon": float(info["longitude_deg"]),
-            "elevation": int(ele),
-            "name": str(info["name"]),
-            "local_code": local_code,
-            "iata": iata
-        }
-
-def _add_lnv_to_database(db, fname):
-    # connect to the database
-    connection = sqlite3.connect(fname)
-    cursor = connection.cursor()
-
-    # select the required values
-    cursor.execute("SELECT ident,name,icao,iata,lonx,laty,altitude FROM airport")
-
-    # add the values to the database
-    for val in cursor:
-        ident = str(val[0]).upper()
-        db[ident] = {
-            "lat": float(val[5]),
-            "lon": float(val[4]),
-            "elevation": int(val[6]),
-            "name": str(val[1]),
-            "local_code": None,
-            "iata": str(val[3])
-        }
+                radius *= 4.0
 
+# airports near a coordinate. the sources are only read when the database has to be rebuilt: from the internet by
+# default, or from a local directory or the url of a mirror with the dumps airports.json of mwgg and airports.csv of
+# ourairports.com.
 class AirportDatabase:
-    def __init__(self, fname):
-        # airports dictionary
-        self.__airportDict = dict()
+    def __init__(self, fname, sources=None):
+        # columns of the airports database
+        self.__columns = None
+        self.__airportTree = None
+        self.__lnvIndex = None
+
+        # path to the binary database next to the json database
+        bin_fname = os.path.splitext(fname)[0] + ".bin"
 
         # path to the little navmap database
         lnv_db_fname = os.environ["APPDATA"] + "\\ABarthel\little_navmap_db\\little_navmap_msfs.sqlite"
 
-        # load from file if possible
-        if os.path.isfile(fname):
-            file_dtime = datetime.datetime.utcfromtimestamp(os.path.getmtime(fname))
-            cur_dtime = datetime.datetime.utcnow()
-            if (cur_dtime-file_dtime) < datetime.timedelta(weeks=2):
-                print("Loading the airports database... ", end="", flush=True)
-                with open(fname, "r") as fd:
-                    self.__airportDict = json.load(fd)
-                print("done!", flush=True)
+        # query the little navmap database directly if available
+        if os.path.isfile(lnv_db_fname):
+            self.__lnvIndex = _LittleNavmapIndex(lnv_db_fname)
+            print("Using a total of %i airports!" % (len(self)))
+            return
+
+        # map the binary database if possible
+        if _is_recent_file(bin_fname):
+            self.__columns = _read_binary_database(bin_fname)
+
+        # fall back to the json database
+        airport_dict = dict()
+        if self.__columns is None and _is_recent_file(fname):
+            print("Loading the airports database... ", end="", flush=True)
+            with open(fname, "r") as fd:
+                airport_dict = json.load(fd)
+            print("done!", flush=True)
         
         # download and fill necessary
-        save_database = False
-        if len(self.__airportDict) == 0:
-            save_database = True
-            if os.path.isfile(lnv_db_fname):
-                print("Importing the Little Navmap database... ", end="", flush=True)
-                _add_lnv_to_database(self.__airportDict, lnv_db_fname)
-                print("done!", flush=True)
-            else:
-                print("Downloading the airports database... ", end="", flush=True)
-                _add_mwgg_to_database(self.__airportDict)
-                _add_ourairports_com_to_database(self.__airportDict)
-                print("done!", flush=True)
+        airports = None
+        if self.__columns is None and len(airport_dict) == 0:
+            print("Downloading the airports database... " if sources is None else "Importing the airports database from %s... " % sources, end="", flush=True)
+            airports = _read_airport_sources(sources)
+            print("done!", flush=True)
+        elif self.__columns is None:
+            airports = _database_to_airports(airport_dict)
         
-        # save the database if necessary
-        if save_database:
+        # save the binary database if necessary
+        if self.__columns is None:
+            assert len(airports["ident"]) > 0
             print("Saving the airports database... ", end="", flush=True)
-            with open(fname, "w") as fd:
-                json.dump(self.__airportDict, fd)
+            self.__columns = _airports_to_columns(airports)
+            _write_binary_database(bin_fname, self.__columns)
             print("done!", flush=True)
         
         # print the number of airports in the database
-        print("Using a total of %i airports!" % (len(self.__airportDict)))
-
-        # store the airport codes searchable by their latitude and longitude as integers
-        assert len(self.__airportDict) > 0
-        self.__idxLat = [None] * 360
-        self.__idxLon = [None] * 360
-        for icao, info in self.__airportDict.items():
-            lat = int(info["lat"] + 180.0)
-            lon = int(info["lon"] + 180.0)
-            assert lat >= 0 and lon >= 0
-            if self.__idxLat[lat] is None:
-                self.__idxLat[lat] = set()
-            self.__idxLat[lat].add(icao)
-            if self.__idxLon[lon] is None:
-                self.__idxLon[lon] = set()
-            self.__idxLon[lon].add(icao)
+        print("Using a total of %i airports!" % (len(self)))
     
-    def find_nearest(self, lat, lon):
-        # convert to integers
-        lat_idx = int(lat + 180.0)
-        lon_idx = int(lon + 180.0)
-        assert lat_idx >= 0 and lon_idx >= 0
-
-        # find candidate airports
-        lat_cands = set()
-        lon_cands = set()
-        for offset in range(-3, +4):
-            # find candidates with latitude offset
-            cand_idx = (lat_idx + offset) % 360
-            if not self.__idxLat[cand_idx] is None:
-                lat_cands.update(self.__idxLat[cand_idx])
-
-            # find candidates with longitude offset
-            cand_idx = (lon_idx + offset) % 360
-            if not self.__idxLon[cand_idx] is None:
-                lon_cands.update(self.__idxLon[cand_idx])
-        cands = lat_cands.intersection(lon_cands)
-        
-        # target coordiate
-        target_coord = LatLon23.LatLon(lat, lon)
-        nearest_icao = None
-        nearest_dist = 999999999.999
-        
-        # check all the candidates
-        for icao in cands:
-            # candidate coordinate
-            info = self.__airportDict[icao]
-            cand_coord = LatLon23.LatLon(info["lat"], info["lon"])
-
-            # distance to the candidate
-            dist = target_coord.distance(cand_coord)
-            
-            # smaller distance?
-            if dist < nearest_dist:
-                nearest_icao = icao
-                nearest_dist = dist
-        
-        # retrieve information about the nearest airport
-        info = self.__airportDict[nearest_icao]
-        if not info["local_code"] is None:
+    def __len__(self):
+        if not self.__lnvIndex is None:
+            return len(self.__lnvIndex)
+        return self.__columns["lat"].shape[0]
+
+    def __get_tree(self):
+        # the spatial index is only built when needed. it takes milliseconds and is not stored, so the database
+        # does not depend on the version of scipy.
+        if self.__airportTree is None:
+            import scipy.spatial
+            self.__airportTree = scipy.spatial.cKDTree(gpx2pln_spatial.to_xyz(self.__columns["lat"], self.__columns["lon"]))
+        return self.__airportTree
+
+    def __airport_info(self, idx):
+        # retrieve information about the airport
+        columns = self.__columns
+        icao = _table_to_string(columns["ident_offsets"], columns["ident_blob"], idx)
+        local_code = _table_to_string(columns["local_code_offsets"], columns["local_code_blob"], idx)
+        if not local_code is None:
             # TODO: need to figure out when to use the local code and when not
-            nearest_icao = info["local_code"]
-        nearest_lat = info["lat"]
-        nearest_lon = info["lon"]
-        nearest_ele = info["elevation"]
-        nearest_name = info["name"]
+            icao = local_code
+        name = _table_to_string(columns["name_offsets"], columns["name_blob"], idx)
+        return icao, float(columns["lat"][idx]), float(columns["lon"][idx]), int(columns["elevation"][idx]), "" if name is None else name
+
+    def find_nearest_many(self, lats, lons, k=1):
+        # the k nearest airports for every coordinate, nearest first
+        lats = np.atleast_1d(np.asarray(lats, dtype=np.float64))
+        lons = np.atleast_1d(np.asarray(lons, dtype=np.float64))
+        assert lats.shape == lons.shape and lats.ndim == 1
+        k = min(k, len(self))
+        assert k > 0
+
+        # little navmap answers every query on its own
+        if not self.__lnvIndex is None:
+            return [self.__lnvIndex.find_nearest(float(lat), float(lon), k) for lat, lon in zip(lats, lons)]
+
+        # candidates by straight distance on the unit sphere. a few more than requested because the order
+        # on the ellipsoid can be slightly different.
+        num_cands = min(len(self), 2 * k + NUM_EXTRA_AIRPORT_CANDIDATES)
+        xyz = gpx2pln_spatial.to_xyz(lats, lons)
+        chords, cands = self.__get_tree().query(xyz, k=num_cands)
+        chords = chords.reshape(len(lats), num_cands)
+        cands = cands.reshape(len(lats), num_cands)
+        gpx2pln_profile.count("airport_candidates", cands.size)
+
+        # exact distances to the candidates
+        dists = gpx2pln_geo.distance(lats[:,None], lons[:,None], self.__columns["lat"][cands], self.__columns["lon"][cands])
+        dists = dists.reshape(len(lats), num_cands)
+        order = np.argsort(dists, axis=1, kind="stable")
+
+        # collect the results
+        results = list()
+        for i in range(len(lats)):
+            cand_idx = cands[i,order[i,:k]]
+
+            # could there be closer airports that were not among the candidates?
+            max_dist = dists[i,order[i,k-1]]
+            if num_cands < len(self) and gpx2pln_spatial.chord_lower_bound(chords[i,-1]) < max_dist:
+                more_cands = np.array(self.__get_tree().query_ball_point(xyz[i], gpx2pln_spatial.chord_radius(max_dist)), dtype=np.intp)
+                gpx2pln_profile.count("airport_candidates", len(more_cands))
+                more_dists = gpx2pln_geo.distance(lats[i], lons[i], self.__columns["lat"][more_cands], self.__columns["lon"][more_cands])
+                cand_idx = more_cands[np.argsort(np.atleast_1d(more_dists), kind="stable")[:k]]
+            
+            results.append([self.__airport_info(int(idx)) for idx in cand_idx])
 
         # finished
-        return nearest_icao, nearest_lat, nearest_lon, int(nearest_ele), nearest_name
+        return results
+    
+    def find_nearest(self, lat, lon):
+        return self.find_nearest_many([lat], [lon], k=1)[0][0]
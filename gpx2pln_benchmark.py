@@ -0,0 +1,374 @@
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import numpy as np
+
+import gpx2pln_chain
+import gpx2pln_convert
+import gpx2pln_douglas_peucker
+import gpx2pln_geo
+import gpx2pln_gpx
+import gpx2pln_legs
+import gpx2pln_simplify
+import gpx2pln_subsample
+import gpx2pln_visvalingam
+from gpx2pln_airports import AirportDatabase
+from gpx2pln_cache import TrackCache
+from gpx2pln_pln import PlnFile
+from gpx2pln_profile import StageProfile, peak_rss
+
+# benchmark of every stage of the pipeline on synthetic inputs. the inputs are generated offline from a fixed seed,
+# so runs on the same machine are comparable. the results are written as json and can be compared to earlier runs.
+
+BENCHMARK_VERSION = 4 # increase whenever the generated inputs or the measured stages change
+BENCHMARK_SEED = 42
+
+# synthetic scenarios. the length of the trail is in kilometers. the track segments are kept longer than the maximum
+# distance between segments, otherwise the stitching of gpx2pln_gpx may skip some of them.
+SCENARIOS = {
+    # one short hike in a single track segment
+    "small": {"num_files": 1, "num_points": 5000, "length": 20.0, "num_segments": 1, "num_airports": 5000},
+    # a long distance trail in a few sections with partly reversed track segments and side trips
+    "medium": {"num_files": 4, "num_points": 250000, "length": 800.0, "num_segments": 3, "num_airports": 20000},
+    # points about 220 meters apart, e.g. a recording with a long interval. every point is kept by the filter of
+    # near points.
+    "sparse": {"num_files": 1, "num_points": 20000, "length": 4400.0, "num_segments": 1, "num_airports": 5000},
+    # about the size of the pacific crest trail
+    "pct": {"num_files": 30, "num_points": 3000000, "length": 4265.0, "num_segments": 2, "num_airports": 60000}
+}
+DEFAULT_SCENARIOS = ["small", "medium", "sparse"]
+
+TRAIL_START = (32.59, -116.47) # southern terminus of the pacific crest trail
+TRAIL_START_TIME = datetime.datetime(2024, 4, 1, tzinfo=datetime.timezone.utc)
+TRAIL_SPEED = 4.0 # in kilometers per hour
+SPUR_LENGTH = (0.5, 3.0) # in kilometers, side trips that are shorter than the minimum segment length
+NUM_AIRPORT_QUERIES = 10000 # nearest airport queries along the track in addition to the ends of the legs
+NUM_CHAIN_SECTIONS = 5000 # shuffled and partly reversed sections of the track for ordering them automatically
+
+# synthetic trail winding northwards. returns latitudes, longitudes, elevations and times.
+def _generate_trail(num_points, length, rng):
+    step = length / (num_points - 1)
+
+    # the heading wanders around north but never turns back
+    headings = np.sin(np.cumsum(rng.normal(0.0, 0.02, num_points))) * 1.2
+    lats = TRAIL_START[0] + np.concatenate(([0.0], np.cumsum(step * np.cos(headings[1:]) / 111.195)))
+    lons = TRAIL_START[1] + np.concatenate(([0.0], np.cumsum(step * np.sin(headings[1:]) / (111.195 * np.cos(np.radians(lats[1:]))))))
+
+    # hills every few dozen kilometers and a constant pace
+    distances = np.arange(num_points) * step
+    elevations = 1500.0 + 1000.0 * np.sin(distances / 40.0) + rng.normal(0.0, 5.0, num_points)
+    times = TRAIL_START_TIME.timestamp() + distances / TRAIL_SPEED * 3600.0
+    return lats, lons, elevations, times
+
+# short side trip starting at the given point of the trail
+def _generate_spur(trail, idx, step, rng):
+    lats, lons, elevations, times = trail
+    num_points = max(2, int(rng.uniform(*SPUR_LENGTH) / step))
+    heading = rng.uniform(0.0, 2.0 * np.pi)
+    offsets = np.arange(num_points) * step
+    spur_lats = lats[idx] + offsets * np.cos(heading) / 111.195
+    spur_lons = lons[idx] + offsets * np.sin(heading) / (111.195 * np.cos(np.radians(lats[idx])))
+    return spur_lats, spur_lons, np.full(num_points, elevations[idx]), times[idx] + offsets / TRAIL_SPEED * 3600.0
+
+# write the track segments as one gpx file
+def _write_gpx(fname, section, segments):
+    with open(fname, "w", encoding="utf-8", buffering=1024*1024) as fd:
+        fd.write("<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n")
+        fd.write("<gpx version=\"1.1\" creator=\"gpx2pln benchmark\" xmlns=\"http://www.topografix.com/GPX/1/1\">\n")
+        fd.write("<metadata><name>Synthetic Trail</name><link href=\"https://example.org/trail/%i\"/>" % section)
+        fd.write("<author><name>gpx2pln benchmark</name><link href=\"https://example.org/author\"/></author></metadata>\n")
+        fd.write("<trk><name>Synthetic Trail, section %i</name>\n" % section)
+        for lats, lons, elevations, times in segments:
+            fd.write("<trkseg>\n")
+            stamps = np.datetime_as_string(times.astype("datetime64[s]"), unit="s").tolist()
+            for lat, lon, ele, stamp in zip(lats.tolist(), lons.tolist(), elevations.tolist(), stamps):
+                fd.write("<trkpt lat=\"%.7f\" lon=\"%.7f\"><ele>%.1f</ele><time>%sZ</time></trkpt>\n" % (lat, lon, ele, stamp))
+            fd.write("</trkseg>\n")
+        fd.write("</trk>\n</gpx>\n")
+
+# synthetic airports database in the format of the json database. uniformly spread over the earth with some
+# more along the trail, so that the nearest airport queries have realistic candidates. the same airports are
+# written as dumps of mwgg and ourairports.com for building the database from its sources.
+def _write_airports(fname, sources_dir, num_airports, trail, rng):
+    num_trail_airports = num_airports // 10
+    lats = np.degrees(np.arcsin(rng.uniform(-1.0, 1.0, num_airports - num_trail_airports)))
+    lons = rng.uniform(-180.0, 180.0, num_airports - num_trail_airports)
+    idx = rng.integers(0, len(trail[0]), num_trail_airports)
+    lats = np.concatenate((lats, trail[0][idx] + rng.normal(0.0, 0.2, num_trail_airports)))
+    lons = np.concatenate((lons, trail[1][idx] + rng.normal(0.0, 0.2, num_trail_airports)))
+    db = dict()
+    for i in range(num_airports):
+        db["X%05i" % i] = {
+            "lat": float(lats[i]),
+            "lon": float(lons[i]),
+            "elevation": int(rng.integers(0, 3000)),
+            "name": "Synthetic Airport %i" % i,
+            "local_code": None,
+            "iata": None
+        }
+    with open(fname, "w") as fd:
+        json.dump(db, fd)
+
+    # dumps of the sources. ourairports.com lacks some elevations, which are taken from mwgg then.
+    os.makedirs(sources_dir, exist_ok=True)
+    mwgg = {icao: {"icao": icao, "iata": "", "name": info["name"], "city": "", "state": "", "country": "", "elevation": info["elevation"], "lat": info["lat"], "lon": info["lon"], "tz": ""} for icao, info in db.items()}
+    with open(os.path.join(sources_dir, "airports.json"), "w") as fd:
+        json.dump(mwgg, fd)
+    with open(os.path.join(sources_dir, "airports.csv"), "w", newline="", encoding="utf-8") as fd:
+        fd.write("\"id\",\"ident\",\"type\",\"name\",\"latitude_deg\",\"longitude_deg\",\"elevation_ft\",\"continent\",\"iso_country\",\"iso_region\",\"municipality\",\"scheduled_service\",\"gps_code\",\"iata_code\",\"local_code\",\"home_link\",\"wikipedia_link\",\"keywords\"\n")
+        for i, (icao, info) in enumerate(db.items()):
+            elevation = "" if i % 10 == 0 else str(info["elevation"])
+            fd.write("%i,\"%s\",\"small_airport\",\"%s\",%r,%r,%s,\"NA\",\"US\",\"US-CA\",\"\",\"no\",\"%s\",\"\",\"\",\"\",\"\",\"\"\n" % (i, icao, info["name"], info["lat"], info["lon"], elevation, icao))
+
+# generate the inputs of a scenario unless they already exist. returns the paths to the gpx files and the airports.
+def generate_scenario(name, directory):
+    scenario = dict(SCENARIOS[name], version=BENCHMARK_VERSION, seed=BENCHMARK_SEED)
+    description_fname = os.path.join(directory, "scenario.json")
+    gpx_fnames = [os.path.join(directory, "section_%03i.gpx" % (i+1)) for i in range(scenario["num_files"])]
+    airports_fname = os.path.join(directory, "airports.json")
+
+    # reuse the inputs of an earlier run
+    if os.path.isfile(description_fname):
+        with open(description_fname, "r") as fd:
+            if json.load(fd) == scenario:
+                return gpx_fnames, airports_fname
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+
+    # one long trail
+    print("Generating the '%s' scenario... " % name, end="", flush=True)
+    rng = np.random.default_rng(BENCHMARK_SEED)
+    trail = _generate_trail(scenario["num_points"], scenario["length"], rng)
+    step = scenario["length"] / (scenario["num_points"] - 1)
+
+    # split into files that share their end points
+    bounds = np.linspace(0, scenario["num_points"] - 1, scenario["num_files"] + 1).astype(np.intp)
+    for i in range(scenario["num_files"]):
+        # split the section into track segments that are partly reversed
+        cuts = np.linspace(bounds[i], bounds[i+1], scenario["num_segments"] + 1).astype(np.intp)
+        segments = list()
+        for j in range(scenario["num_segments"]):
+            segment = tuple(x[cuts[j]:cuts[j+1]+1] for x in trail)
+            if scenario["num_segments"] > 1 and rng.uniform() < 0.3:
+                segment = tuple(x[::-1] for x in segment)
+            segments.append(segment)
+
+        # some short side trips that have to be dropped
+        for _ in range(scenario["num_segments"]):
+            segments.insert(int(rng.integers(0, len(segments) + 1)), _generate_spur(trail, int(rng.integers(bounds[i], bounds[i+1])), step, rng))
+        _write_gpx(gpx_fnames[i], i+1, segments)
+
+    # airports and the description of the scenario last, so that interrupted runs are not reused
+    _write_airports(airports_fname, os.path.join(directory, "sources"), scenario["num_airports"], trail, rng)
+    with open(description_fname, "w") as fd:
+        json.dump(scenario, fd)
+    print("done!", flush=True)
+    return gpx_fnames, airports_fname
+
+# run the whole pipeline once and measure every stage
+def run_scenario(name, directory, settings):
+    gpx_fnames, airports_fname = generate_scenario(name, directory)
+    output_dir = os.path.join(directory, "output")
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.makedirs(output_dir)
+    max_leg_length = settings["max_leg_length"] * 1.609344
+    profile = StageProfile()
+
+    # HINT: the airports database looks for little navmap in the application data. it must not be found.
+    os.environ["APPDATA"] = directory
+
+    # the stages import some modules lazily. gpx2pln_check_startup.py covers that, it is not measured here.
+    import scipy.spatial
+    if not settings["no_plot"]:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+
+    # reading the gpx files
+    with profile.stage("parse") as stage:
+        parsed = [gpx2pln_gpx._read_gpx(x) for x in gpx_fnames]
+        stage["num_items"] = sum(len(x) for _, segments in parsed for x in segments)
+    with profile.stage("stitch", profile.get_stage("parse")["num_items"]):
+        tracks = [gpx2pln_gpx._choose_track_segments(segments) for _, segments in parsed]
+
+    # the cache of parsed gpx files, which also provides the objects for concatenating
+    cache = TrackCache(os.path.join(output_dir, "cache"))
+    with profile.stage("cache_store", sum(len(x) for x in tracks)):
+        for fname, (metadata, _), track in zip(gpx_fnames, parsed, tracks):
+            cache.store(cache.key(fname, gpx2pln_gpx.GPX_PARSER_VERSION), metadata, track)
+    del parsed
+    with profile.stage("cache_load", sum(len(x) for x in tracks)):
+        gpx_files = [gpx2pln_gpx.GpxFile(x, cache) for x in gpx_fnames]
+    with profile.stage("concat", sum(len(x) for x in gpx_files)):
+        gpx = gpx2pln_gpx.GpxConcat(gpx_files)
+        track = gpx.get_track_coords()
+
+    # remove the points that are near to each other, like subsample does it. measured for every algorithm.
+    with profile.stage("filter", len(track)):
+        gpx2pln_subsample._filter_near_points(track.get_lats(), track.get_lons())
+
+    # order many sections of the track that are given in no particular order. they share their end points.
+    rng = np.random.default_rng(BENCHMARK_SEED)
+    bounds = np.linspace(0, len(track) - 1, min(NUM_CHAIN_SECTIONS, len(track) - 1) + 1).astype(np.intp)
+    sections = [track.take([bounds[i+1], bounds[i]] if rng.uniform() < 0.5 else [bounds[i], bounds[i+1]]) for i in range(len(bounds) - 1)]
+    sections = [sections[i] for i in rng.permutation(len(sections))]
+    with profile.stage("auto_order", len(sections)):
+        gpx2pln_chain.chain_tracks(sections)
+
+    # simplify and split the track. douglas-peucker simplifies the whole track, the others every leg.
+    if settings["algorithm"] == "douglas-peucker":
+        with profile.stage("simplify", len(track)):
+            track = track.take(gpx2pln_simplify.douglas_peucker_indices(track.get_lats(), track.get_lons(), settings["tolerance"]))
+        with profile.stage("split", len(track)):
+            ranges = gpx2pln_legs.leg_ranges(gpx2pln_geo.cumulative_distance(track.get_lats(), track.get_lons()), max_leg_length)
+            legs = [track[x[0]:x[1]+1] for x in ranges]
+    else:
+        module = gpx2pln_subsample if settings["algorithm"] == "subsample" else gpx2pln_visvalingam
+        with profile.stage("split", len(track)):
+            track, ranges = module.split_legs(track, max_leg_length)
+            legs = [track[x[0]:x[1]+1] for x in ranges]
+        with profile.stage("simplify", len(track)):
+            if settings["algorithm"] == "subsample":
+                legs = [gpx2pln_subsample.subsample_leg(x, settings["num_leg_points"]) for x in legs]
+            else:
+                legs = [gpx2pln_visvalingam.visvalingam_leg(x, settings["num_leg_points"]) for x in legs]
+
+    # the airports database is built from the json database once and then mapped from the binary database
+    quiet = io.StringIO()
+    with profile.stage("airport_build", SCENARIOS[name]["num_airports"]), contextlib.redirect_stdout(quiet):
+        bin_fname = os.path.splitext(airports_fname)[0] + ".bin"
+        if os.path.isfile(bin_fname):
+            os.remove(bin_fname)
+        os.utime(airports_fname) # never too old to be used
+        AirportDatabase(airports_fname)
+    with profile.stage("airport_load", SCENARIOS[name]["num_airports"]), contextlib.redirect_stdout(quiet):
+        airport_db = AirportDatabase(airports_fname)
+
+    # the airports database is also built from the dumps of its sources, like on a host without internet access
+    with profile.stage("airport_ingest", 2 * SCENARIOS[name]["num_airports"]), contextlib.redirect_stdout(quiet):
+        ingest_fname = os.path.join(directory, "ingest.json")
+        if os.path.isfile(os.path.join(directory, "ingest.bin")):
+            os.remove(os.path.join(directory, "ingest.bin"))
+        AirportDatabase(ingest_fname, os.path.join(directory, "sources"))
+
+    # nearest airports to the ends of the legs and to many points along the track
+    query_idx = np.linspace(0, len(gpx.get_track_coords()) - 1, NUM_AIRPORT_QUERIES).astype(np.intp)
+    query_lats = [x.get_lats()[0] for x in legs] + [x.get_lats()[-1] for x in legs] + gpx.get_track_coords().get_lats()[query_idx].tolist()
+    query_lons = [x.get_lons()[0] for x in legs] + [x.get_lons()[-1] for x in legs] + gpx.get_track_coords().get_lons()[query_idx].tolist()
+    with profile.stage("airport_lookup", len(query_lats)):
+        airports = [x[0] for x in airport_db.find_nearest_many(query_lats, query_lons)]
+
+    # write the pln files
+    with profile.stage("pln_write", sum(len(x) for x in legs)):
+        for i in range(len(legs)):
+            pln = PlnFile("Synthetic Trail (%i)" % (i+1), "Synthetic Trail by gpx2pln benchmark", legs[i], elevation=gpx.get_max_elevation())
+            pln.write(os.path.join(output_dir, "leg_%i.pln" % (i+1)), None, airports[i], airports[len(legs)+i])
+
+    # plot the result
+    if not settings["no_plot"]:
+        with profile.stage("plot", len(gpx.get_track_coords())):
+            gpx2pln_convert._plot_gpx_and_pln(gpx.get_track_coords(), legs, os.path.join(output_dir, "plot.jpg"), settings["raster_plot"])
+            plt.close("all")
+
+    # finished
+    return {"num_points": len(gpx.get_track_coords()), "num_legs": len(legs), "stages": profile.get_stages()}
+
+# keep the fastest run of every stage
+def _fastest(runs):
+    result = dict(runs[0])
+    result["stages"] = list()
+    for i in range(len(runs[0]["stages"])):
+        result["stages"].append(min((x["stages"][i] for x in runs), key=lambda x: x["wall_seconds"]))
+    return result
+
+def _print_stages(stages):
+    for stage in stages:
+        line = "  %-15s %9.3f s wall %9.3f s cpu" % (stage["name"], stage["wall_seconds"], stage["cpu_seconds"])
+        if not stage["items_per_second"] is None:
+            line += " %12.0f items/s" % stage["items_per_second"]
+        if not stage["peak_rss_bytes"] is None:
+            line += " %8.1f MB peak" % (stage["peak_rss_bytes"] / (1024.0 * 1024.0))
+        print(line)
+
+# compare with the results of an earlier run
+def _print_comparison(old_results, new_results):
+    print("Comparison with the earlier run (new / old wall time):")
+    for name, scenario in new_results["scenarios"].items():
+        if not name in old_results["scenarios"]:
+            continue
+        old_stages = {x["name"]: x for x in old_results["scenarios"][name]["stages"]}
+        for stage in scenario["stages"]:
+            if not stage["name"] in old_stages or old_stages[stage["name"]]["wall_seconds"] <= 0.0:
+                continue
+            old_seconds = old_stages[stage["name"]]["wall_seconds"]
+            print("  %-8s %-15s %9.3f s -> %9.3f s %6.2fx" % (name, stage["name"], old_seconds, stage["wall_seconds"], stage["wall_seconds"] / old_seconds))
+
+def main():
+    # parse command line arguments
+    parser = argparse.ArgumentParser(description="Benchmark the stages of gpx2pln on synthetic GPX files and airports.")
+    parser.add_argument("--scenarios", type=str, nargs="+", default=DEFAULT_SCENARIOS, help="Scenarios to run. Values: %s." % ", ".join("'%s'" % x for x in SCENARIOS))
+    parser.add_argument("--work_dir", type=str, default=os.path.join(tempfile.gettempdir(), "gpx2pln_benchmark"), help="Directory for the generated inputs, which are reused by later runs.")
+    parser.add_argument("--output", type=str, default="gpx2pln_benchmark.json", help="Path to the JSON file to write the results to.")
+    parser.add_argument("--compare", type=str, default=None, help="Path to the JSON file of an earlier run to compare with.")
+    parser.add_argument("--repeat", type=int, default=1, help="Number of runs of every scenario. The fastest run of every stage is reported.")
+    parser.add_argument("--algorithm", type=str, default="douglas-peucker", help="Algorithm for choosing waypoints. Values: 'subsample', 'douglas-peucker', 'visvalingam'.")
+    parser.add_argument("--max_leg_length", type=int, default=500, help="Maximum length of one leg in miles.")
+    parser.add_argument("--num_leg_points", type=int, default=5, help="Number of waypoints per leg for 'subsample' and 'visvalingam'.")
+    parser.add_argument("--tolerance", type=float, default=gpx2pln_douglas_peucker.DEFAULT_TOLERANCE, help="Maximum distance in kilometers for 'douglas-peucker'.")
+    parser.add_argument("--raster_plot", action="store_true", help="Plot the GPX track as a raster.")
+    parser.add_argument("--no_plot", action="store_true", help="Do not benchmark plotting.")
+    args = parser.parse_args()
+
+    # sanity checks
+    assert all(x in SCENARIOS for x in args.scenarios)
+    assert args.repeat > 0
+    assert args.algorithm in ["subsample", "douglas-peucker", "visvalingam"]
+
+    # run the scenarios
+    settings = {
+        "algorithm": args.algorithm,
+        "max_leg_length": args.max_leg_length,
+        "num_leg_points": args.num_leg_points,
+        "tolerance": args.tolerance,
+        "raster_plot": args.raster_plot,
+        "no_plot": args.no_plot,
+        "repeat": args.repeat
+    }
+    results = {
+        "benchmark_version": BENCHMARK_VERSION,
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": sys.version,
+        "platform": platform.platform(),
+        "numpy": np.__version__,
+        "settings": settings,
+        "scenarios": dict()
+    }
+    for name in args.scenarios:
+        runs = [run_scenario(name, os.path.join(args.work_dir, name), settings) for _ in range(args.repeat)]
+        results["scenarios"][name] = dict(_fastest(runs), parameters=SCENARIOS[name])
+        print("Scenario '%s' with %i points and %i legs:" % (name, runs[0]["num_points"], runs[0]["num_legs"]))
+        _print_stages(results["scenarios"][name]["stages"])
+    results["peak_rss_bytes"] = peak_rss()
+
+    # save the results
+    with open(args.output, "w") as fd:
+        json.dump(results, fd, indent=2)
+    print("Results written to %s!" % args.output)
+
+    # compare if requested
+    if not args.compare is None:
+        with open(args.compare, "r") as fd:
+            old_results = json.load(fd)
+        if old_results["benchmark_version"] != BENCHMARK_VERSION:
+            print("The earlier run used a different benchmark version, the numbers may not be comparable!")
+        _print_comparison(old_results, results)
+
+if __name__ == "__main__":
+    main()
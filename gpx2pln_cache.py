@@ -0,0 +1,130 @@
+import hashlib
+import json
+import os
+import struct
+import threading
+import numpy as np
+from gpx2pln_track import Track
+
+# on-disk cache of parsed gpx files. entries are addressed by the hash of the file content and the version of the
+# parser, so renamed or copied files are found again and changes to the parser never return stale results.
+# every entry is one file: a small json header with the metadata followed by the raw track arrays.
+
+CACHE_MAGIC = b"GPX2PLNC"
+DEFAULT_MAX_CACHE_SIZE = 512 * 1024 * 1024 # in bytes
+HASH_BLOCK_SIZE = 1024 * 1024 # in bytes
+
+# hash of the content of a file and a version. the content can also be given as bytes.
+def content_key(fname, version):
+    digest = hashlib.sha256(("%s\n" % version).encode("utf-8"))
+    if type(fname) == bytes:
+        digest.update(fname)
+        return digest.hexdigest()
+    with open(fname, "rb") as fd:
+        while True:
+            block = fd.read(HASH_BLOCK_SIZE)
+            if len(block) == 0:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+class TrackCache:
+    def __init__(self, directory, max_size=DEFAULT_MAX_CACHE_SIZE):
+        self.__directory = directory
+        self.__maxSize = max_size
+        os.makedirs(self.__directory, exist_ok=True)
+
+    def key(self, fname, version):
+        # entries are addressed by the hash of the file content and the parser version
+        return content_key(fname, version)
+
+    def __entry_fname(self, key):
+        return os.path.join(self.__directory, key + ".gpxc")
+
+    def load(self, key):
+        # metadata and track of the entry, none if not cached
+        fname = self.__entry_fname(key)
+        try:
+            with open(fname, "rb") as fd:
+                if fd.read(len(CACHE_MAGIC)) != CACHE_MAGIC:
+                    return None
+                header_len = struct.unpack("<Q", fd.read(8))[0]
+                header = json.loads(fd.read(header_len).decode("utf-8"))
+                num_points = header["num_points"]
+                columns = np.fromfile(fd, dtype="<f8", count=header["num_columns"] * num_points)
+        except (OSError, ValueError, struct.error):
+            return None
+        if columns.shape[0] != header["num_columns"] * num_points:
+            return None
+        columns = columns.reshape(header["num_columns"], num_points)
+
+        # mark as recently used
+        try:
+            os.utime(fname)
+        except OSError:
+            pass
+
+        # convert back
+        metadata = header["metadata"]
+        for name in ("track_links", "author_links"):
+            metadata[name] = set(metadata[name])
+        elevations = columns[2] if header["has_elevations"] else None
+        times = columns[-1] if header["has_times"] else None
+        return metadata, Track(columns[0], columns[1], elevations, times)
+
+    def store(self, key, metadata, track):
+        # the arrays to store
+        columns = [track.get_lats(), track.get_lons()]
+        if not track.get_elevations() is None:
+            columns.append(track.get_elevations())
+        if not track.get_times() is None:
+            columns.append(track.get_times())
+
+        # header with the metadata. sets are stored as sorted lists.
+        metadata = dict(metadata)
+        for name in ("track_links", "author_links"):
+            metadata[name] = sorted(metadata[name])
+        header = json.dumps({
+            "metadata": metadata,
+            "num_points": len(track),
+            "num_columns": len(columns),
+            "has_elevations": not track.get_elevations() is None,
+            "has_times": not track.get_times() is None
+        }).encode("utf-8")
+
+        # write to a temporary file first. several processes and threads may store entries at the same time.
+        fname = self.__entry_fname(key)
+        tmp_fname = "%s.%i.%i.tmp" % (fname, os.getpid(), threading.get_ident())
+        with open(tmp_fname, "wb") as fd:
+            fd.write(CACHE_MAGIC)
+            fd.write(struct.pack("<Q", len(header)))
+            fd.write(header)
+            for values in columns:
+                np.ascontiguousarray(values, dtype="<f8").tofile(fd)
+        os.replace(tmp_fname, fname)
+
+        # keep the cache within its size
+        self.__evict()
+
+    def __evict(self):
+        # remove the least recently used entries until the cache is small enough
+        entries = list()
+        total_size = 0
+        for name in os.listdir(self.__directory):
+            if not name.endswith(".gpxc"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.__directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+            total_size += stat.st_size
+        entries.sort()
+        for _, size, name in entries:
+            if total_size <= self.__maxSize:
+                break
+            try:
+                os.remove(os.path.join(self.__directory, name))
+            except OSError:
+                pass
+            total_size -= size
@@ -0,0 +1,174 @@
+import time
+import numpy as np
+import gpx2pln_profile
+import gpx2pln_spatial
+
+# automatic ordering and orientation of tracks that are given in no particular order, e.g. the sections of a trail
+# with scrambled file names. the tracks are chained into one path so that the gaps between the end of every track
+# and the start of the next one are as short as possible. only the first and the last point of every track are
+# used. the end points are numbered 2*i for the start and 2*i+1 for the end of track i, distances are chords on
+# the unit sphere.
+
+NUM_NEIGHBOURS = 8 # nearest end points that are candidates for following each other
+MAX_TWO_OPT_ROUNDS = 100 # rounds of improving the chain after it was built. usually done after a few dozen.
+DEFAULT_TIME_LIMIT = 10.0 # in seconds, only a safety net. the result depends on the time if it is reached.
+
+# order and orientation of the tracks. returns the indices of the tracks in order and for every one of them
+# whether it has to be reversed. the chain runs from the earlier to the later tracks of the given order where it
+# does not matter, so already ordered tracks stay as they are.
+def chain_tracks(tracks, time_limit=DEFAULT_TIME_LIMIT):
+    num_tracks = len(tracks)
+    if num_tracks < 2:
+        return list(range(num_tracks)), [False] * num_tracks
+    lats = np.ravel([(x.get_lats()[0], x.get_lats()[-1]) for x in tracks])
+    lons = np.ravel([(x.get_lons()[0], x.get_lons()[-1]) for x in tracks])
+    xyz = gpx2pln_spatial.to_xyz(lats, lons)
+
+    # nearest neighbours of every end point. the first one is the point itself, unless another one is at the same place.
+    import scipy.spatial
+    tree = scipy.spatial.cKDTree(xyz)
+    _, neighbours = tree.query(xyz, k=min(NUM_NEIGHBOURS + 1, len(xyz)))
+
+    # build the chain and improve it for a while
+    partners = _greedy_partners(xyz, tree)
+    order, reverse = _follow_partners(partners)
+    order, reverse = _two_opt(order, reverse, xyz, neighbours[:,1:], time_limit)
+
+    # run from the earlier to the later tracks
+    if order[0] > order[-1]:
+        order = order[::-1]
+        reverse = [not x for x in reverse[::-1]]
+    return order, reverse
+
+# which end points follow each other. the shortest gaps between end points of different chains are used first, like
+# kruskal's algorithm does it for spanning trees, until all tracks are in one chain. only the nearest neighbours are
+# candidates, the end points that are still free are searched again until nothing is left to connect.
+def _greedy_partners(xyz, tree):
+    import scipy.spatial
+    num_points = len(xyz)
+    partners = [-1] * num_points
+    chains = list(range(num_points // 2)) # union-find over the tracks
+    def find(i):
+        while chains[i] != i:
+            chains[i] = chains[chains[i]]
+            i = chains[i]
+        return i
+
+    # all end points are free at first
+    free = np.arange(num_points)
+    free_tree = tree
+    num_chains = num_points // 2
+    while num_chains > 1:
+        # candidate gaps between free end points of different tracks, shortest first
+        k = min(NUM_NEIGHBOURS + 1, len(free))
+        dists, cands = free_tree.query(xyz[free], k=k)
+        first = np.repeat(free, k)
+        second = free[cands.ravel()]
+        dists = dists.ravel()
+        valid = first < second
+        first, second, dists = first[valid], second[valid], dists[valid]
+        order = np.argsort(dists, kind="stable")
+
+        # connect if both end points are free and the tracks are in different chains
+        for a, b in zip(first[order].tolist(), second[order].tolist()):
+            if partners[a] >= 0 or partners[b] >= 0:
+                continue
+            chain_a = find(a // 2)
+            chain_b = find(b // 2)
+            if chain_a == chain_b:
+                continue
+            chains[chain_a] = chain_b
+            partners[a] = b
+            partners[b] = a
+            num_chains -= 1
+
+        # search again among the end points that are still free
+        free = np.array([i for i in free.tolist() if partners[i] < 0], dtype=np.intp)
+        free_tree = scipy.spatial.cKDTree(xyz[free])
+    return partners
+
+# tracks in order along the chain given by the partners of the end points
+def _follow_partners(partners):
+    # start at a free end point
+    entry = partners.index(-1)
+    order = list()
+    reverse = list()
+    while entry >= 0:
+        order.append(entry // 2)
+        reverse.append(entry % 2 == 1)
+        entry = partners[entry ^ 1] # the other end point leads to the next track
+    assert len(order) == len(partners) // 2
+    return order, reverse
+
+# improve the chain by reversing parts of it. reversing the tracks between two gaps replaces those gaps by the
+# gap between the two exits and the gap between the two entries, which is done whenever it is shorter. only the
+# nearest neighbours of the end points are tried. every round evaluates the moves from all active gaps at once and
+# does the best ones that do not overlap. the first round looks at all gaps, the later ones only at the gaps that
+# changed or still have a move left, until nothing improves anymore or the rounds are used up. the result only
+# depends on the input unless the time limit is reached.
+def _two_opt(order, reverse, xyz, neighbours, time_limit):
+    import bisect
+    deadline = time.perf_counter() + time_limit
+    num_tracks = len(order)
+    order = np.array(order, dtype=np.intp)
+    reverse = np.array(reverse, dtype=bool)
+
+    # the gaps are numbered by the position before them plus one, from 0 before the start to the number of tracks
+    # after the end. every gap has the exit before it and the entry after it, except at the ends of the chain.
+    def gap_ends(gaps, exits, entries):
+        return xyz[exits[np.maximum(gaps - 1, 0)]], gaps > 0, xyz[entries[np.minimum(gaps, num_tracks - 1)]], gaps < num_tracks
+    def dist(a, valid_a, b, valid_b):
+        return np.where(valid_a & valid_b, np.linalg.norm(a - b, axis=-1), 0.0)
+
+    # the moves start at the inner gaps
+    active = np.arange(1, num_tracks)
+    num_moves = 0
+    num_rounds = 0
+    while len(active) > 0 and num_rounds < MAX_TWO_OPT_ROUNDS and time.perf_counter() < deadline:
+        num_rounds += 1
+
+        # end points where the tracks are entered and left, and the positions of the tracks in the chain
+        entries = 2 * order + reverse
+        exits = 2 * order + 1 - reverse
+        positions = np.empty(num_tracks, dtype=np.intp)
+        positions[order] = np.arange(num_tracks)
+
+        # other gaps: after exits near the exit before the gap and before entries near the entry after it
+        points = neighbours[exits[active - 1]]
+        is_exit = points == exits[positions[points // 2]]
+        other_after = np.where(is_exit, positions[points // 2] + 1, -1)
+        points = neighbours[entries[active]]
+        is_entry = points == entries[positions[points // 2]]
+        other_before = np.where(is_entry, positions[points // 2], -1)
+        first = np.repeat(active, 2 * neighbours.shape[1])
+        second = np.concatenate((other_after, other_before), axis=1).ravel()
+        valid = (second >= 0) & (second != first)
+        lo = np.minimum(first, second)[valid]
+        hi = np.maximum(first, second)[valid]
+
+        # improvements by the moves, best first
+        lo_exits, lo_has_exit, lo_entries, lo_has_entry = gap_ends(lo, exits, entries)
+        hi_exits, hi_has_exit, hi_entries, hi_has_entry = gap_ends(hi, exits, entries)
+        delta = dist(lo_exits, lo_has_exit, hi_exits, hi_has_exit) + dist(lo_entries, lo_has_entry, hi_entries, hi_has_entry) - dist(lo_exits, lo_has_exit, lo_entries, lo_has_entry) - dist(hi_exits, hi_has_exit, hi_entries, hi_has_entry)
+        improving = np.flatnonzero(delta < -1e-12)
+        improving = improving[np.argsort(delta[improving], kind="stable")]
+
+        # reverse the tracks between the gaps. moves between other gaps do not change each other. the gaps of the
+        # moves that were done or skipped are looked at again in the next round.
+        done = list() # gaps of the moves done so far, sorted
+        touched = set()
+        for lo_gap, hi_gap in zip(lo[improving].tolist(), hi[improving].tolist()):
+            touched.update((lo_gap, hi_gap))
+            i = bisect.bisect_left(done, (lo_gap, -1))
+            if i > 0 and done[i-1][1] >= lo_gap or i < len(done) and done[i][0] <= hi_gap:
+                continue
+            done.insert(i, (lo_gap, hi_gap))
+            order[lo_gap:hi_gap] = order[lo_gap:hi_gap][::-1]
+            reverse[lo_gap:hi_gap] = ~reverse[lo_gap:hi_gap][::-1]
+        num_moves += len(done)
+        active = np.array(sorted(x for x in touched if 0 < x < num_tracks), dtype=np.intp)
+
+    # finished
+    gpx2pln_profile.count("chain_two_opt_rounds", num_rounds)
+    gpx2pln_profile.count("chain_two_opt_moves", num_moves)
+    return order.tolist(), reverse.tolist()
@@ -0,0 +1,61 @@
+import argparse
+import subprocess
+import sys
+
+# regression check for the startup time of gpx2pln. every check imports some modules in a fresh interpreter and
+# makes sure that the heavy modules stay lazy and that the import stays within its time budget.
+
+# modules that are only allowed to be imported by the stage that needs them
+HEAVY_MODULES = ["numpy", "scipy", "pyproj", "matplotlib", "skimage", "sqlite3"]
+STAGE_ONLY_MODULES = ["scipy", "matplotlib", "skimage", "sqlite3"]
+
+# pipeline modules that are imported once the command line is parsed
+PIPELINE_MODULES = ["gpx2pln_convert", "gpx2pln_gpx", "gpx2pln_pln", "gpx2pln_airports", "gpx2pln_cache", "gpx2pln_chain", "gpx2pln_subsample", "gpx2pln_douglas_peucker", "gpx2pln_visvalingam"]
+
+DEFAULT_CLI_BUDGET = 0.05 # in seconds
+DEFAULT_PIPELINE_BUDGET = 0.5 # in seconds
+NUM_REPETITIONS = 3 # the fastest run counts, the first one often suffers from a cold file cache
+
+# import the modules in a fresh interpreter. returns the import time in seconds and the loaded modules.
+def _import_in_subprocess(modules):
+    code = "import sys, time\nstart = time.perf_counter()\nimport %s\nprint(time.perf_counter() - start)\nprint(' '.join(sys.modules.keys()))" % ", ".join(modules)
+    output = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True).stdout.splitlines()
+    return float(output[0]), set(output[1].split())
+
+# check one set of modules. returns the list of problems.
+def _check(name, modules, forbidden, budget):
+    runs = [_import_in_subprocess(modules) for _ in range(NUM_REPETITIONS)]
+    duration = min(x[0] for x in runs)
+    loaded = runs[0][1]
+    print("%s: %.1f ms (budget %.1f ms)" % (name, duration * 1000.0, budget * 1000.0), flush=True)
+
+    # forbidden modules, including their submodules
+    problems = list()
+    for module in forbidden:
+        if any(x == module or x.startswith(module + ".") for x in loaded):
+            problems.append("%s imports %s" % (name, module))
+    if duration > budget:
+        problems.append("%s takes %.1f ms instead of at most %.1f ms" % (name, duration * 1000.0, budget * 1000.0))
+    return problems
+
+def main():
+    # parse command line arguments
+    parser = argparse.ArgumentParser(description="Check that gpx2pln starts fast and imports heavy modules lazily.")
+    parser.add_argument("--cli_budget", type=float, default=DEFAULT_CLI_BUDGET, help="Maximum time in seconds for importing the command line tool.")
+    parser.add_argument("--pipeline_budget", type=float, default=DEFAULT_PIPELINE_BUDGET, help="Maximum time in seconds for importing the pipeline modules.")
+    args = parser.parse_args()
+
+    # the command line tool only needs the standard library until the arguments are parsed, the pipeline must not
+    # pull in plotting, smoothing or the optional backends
+    problems = _check("gpx2pln", ["gpx2pln"], HEAVY_MODULES, args.cli_budget)
+    problems += _check("pipeline", PIPELINE_MODULES, STAGE_ONLY_MODULES, args.pipeline_budget)
+
+    # report
+    for problem in problems:
+        print("FAILED: " + problem)
+    if len(problems) > 0:
+        sys.exit(1)
+    print("Startup is fine!")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,524 @@
+import math
+import os
+import gpx2pln_profile
+
+# in-process api for converting gpx tracks to pln files. a converter keeps the airports database, the worker pool and
+# the cache of parsed gpx files between conversions, so it serves the command line tool as well as the server.
+# HINT: like gpx2pln.py, this module only imports the heavy modules in the stage that needs them.
+
+ALGORITHMS = ["subsample", "douglas-peucker", "visvalingam"]
+MILES_TO_KILOMETERS = 1.609344
+
+PLOT_DPI = 300 # resolution of the saved plot
+PLOT_MARGIN = 0.05 # relative to the extent of the data, like matplotlib does it
+PLOT_MINIMUM_EXTENT = 1e-3 # in degree, keeps the raster valid for tracks without any extent
+PLOT_RASTER_CELL_SIZE = 4 # in pixels of the saved plot
+PLOT_RASTER_DOT_RADIUS = 2 # in raster cells, about the size of the dots in the regular plot
+PLOT_RASTER_CHUNK_SIZE = 1000000 # points of the gpx track rasterized at once
+
+LEG_CHUNK_SIZE = 65536 # points simplified at once in memory. smaller chunks hand out the first legs earlier.
+DEFAULT_CHUNK_SIZE = 1000000 # points of a track processed at once out of core
+MAX_PENDING_TASKS = 64 # tasks handed to the pool whose results were not taken yet
+
+# raised when none of the gpx files of a route has a track with at least two distinct points
+class EmptyRouteError(Exception):
+    pass
+
+# worker function for reading/processing gpx files in multiple processes. the track is handed back in a
+# memory-mapped file if requested instead of pickling all the coordinates.
+def _worker_gpx_fname_to_obj(task):
+    from gpx2pln_gpx import GpxFile
+    fname, track_fname, cache = task
+    obj = GpxFile(fname, cache)
+    if len(obj) > 0:
+        if not track_fname is None:
+            obj.move_track_to_file(track_fname)
+        return obj
+    return None
+
+# worker function for choosing the waypoints of one leg and writing it as a pln file. without an algorithm the
+# waypoints are chosen already, without a file name the pln file is handed back as bytes.
+def _worker_leg_to_pln(task):
+    from gpx2pln_pln import PlnFile
+    algorithm, leg, num_leg_points, fname, title, description, elevation, departure_airport, destination_airport = task
+    if algorithm == "subsample":
+        import gpx2pln_subsample
+        leg = gpx2pln_subsample.subsample_leg(leg, num_leg_points)
+    elif algorithm == "visvalingam":
+        import gpx2pln_visvalingam
+        leg = gpx2pln_visvalingam.visvalingam_leg(leg, num_leg_points)
+    pln = PlnFile(title, description, leg, elevation=elevation)
+    if not fname is None:
+        pln.write(fname, None, departure_airport, destination_airport)
+        return leg, None
+    import io
+    fd = io.StringIO()
+    pln.write(fd, None, departure_airport, destination_airport)
+    return leg, fd.getvalue().encode("utf-8", errors="xmlcharrefreplace")
+
+# call a worker function and hand back the operations it counted along with the result
+def _worker_counted(task):
+    func, value = task
+    snapshot = gpx2pln_profile.get_counters()
+    result = func(value)
+    return result, gpx2pln_profile.counters_since(snapshot)
+
+# map lazily in the pool or in this process if there is none. the values are only taken from the iterable while
+# fewer than max_pending of them are in the pool, so the stage before keeps working while the pool catches up. the
+# results come in order and the counters of the workers are added to this process.
+def _imap(pool, func, values, max_pending=MAX_PENDING_TASKS):
+    import collections
+    if pool is None:
+        for x in values:
+            yield func(x)
+        return
+    def take():
+        result, counters = pending.popleft().get()
+        gpx2pln_profile.add_counters(counters)
+        return result
+    pending = collections.deque()
+    for x in values:
+        pending.append(pool.apply_async(_worker_counted, ((func, x),)))
+        while len(pending) >= max_pending or (len(pending) > 0 and pending[0].ready()):
+            yield take()
+    while len(pending) > 0:
+        yield take()
+
+# the legs of a track, handed out as soon as they are complete
+def _iter_legs(track, route, chunk_size, in_memory=True):
+    import gpx2pln_subsample
+    import gpx2pln_douglas_peucker
+    import gpx2pln_visvalingam
+
+    # convert the maximum leg length from miles to kilometres
+    max_leg_length = None if route["max_leg_length"] is None else route["max_leg_length"] * MILES_TO_KILOMETERS
+    if route["algorithm"] == "subsample":
+        return gpx2pln_subsample.iter_legs(track, max_leg_length, chunk_size)
+    elif route["algorithm"] == "douglas-peucker":
+        return gpx2pln_douglas_peucker.iter_legs(track, max_leg_length, chunk_size, route["tolerance"], route["smooth"], in_memory)
+    elif route["algorithm"] == "visvalingam":
+        return gpx2pln_visvalingam.iter_legs(track, max_leg_length, chunk_size)
+    raise ValueError("Unknown algorithm '%s'." % route["algorithm"])
+
+# same as _iter_legs() for routes that are not smoothed, but with the indices of the points of every leg in the track
+def _iter_leg_indices(track, route, chunk_size):
+    import gpx2pln_subsample
+    import gpx2pln_douglas_peucker
+    import gpx2pln_visvalingam
+    assert not route["smooth"]
+    max_leg_length = None if route["max_leg_length"] is None else route["max_leg_length"] * MILES_TO_KILOMETERS
+    if route["algorithm"] == "subsample":
+        return gpx2pln_subsample.iter_leg_indices(track, max_leg_length, chunk_size)
+    elif route["algorithm"] == "douglas-peucker":
+        return gpx2pln_douglas_peucker.iter_leg_indices(track, max_leg_length, chunk_size, route["tolerance"])
+    elif route["algorithm"] == "visvalingam":
+        return gpx2pln_visvalingam.iter_leg_indices(track, max_leg_length, chunk_size)
+    raise ValueError("Unknown algorithm '%s'." % route["algorithm"])
+
+# the legs of a track planned by gpx2pln_incremental.plan_legs(). ranges are split into new legs, the waypoints of
+# kept legs are used as they are and only written again if their number changed or their pln file is missing. the
+# first and the last point of every leg in the track are added to bounds.
+def _iter_planned_legs(track, route, plan, chunk_size, bounds):
+    import numpy as np
+    from gpx2pln_track import Track
+    for entry in plan:
+        if entry["waypoints"] is None:
+            for indices in _iter_leg_indices(track[entry["start"]:entry["end"]+1], route, chunk_size):
+                bounds.append((entry["start"] + int(indices[0]), entry["start"] + int(indices[-1])))
+                yield track.take(indices + entry["start"]), route["algorithm"], True
+        else:
+            bounds.append((entry["start"], entry["end"]))
+            waypoints = np.array(entry["waypoints"], dtype=np.float64)
+            write = entry["counter"] != len(bounds) or not os.path.isfile(route["pln_stem"] + "_" + str(len(bounds)) + ".pln")
+            yield Track(waypoints[:,0], waypoints[:,1]), None, write
+
+# draw the gpx track as a raster with the resolution of the saved image instead of one dot per point. the cost
+# only depends on the size of the image, not on the number of points. the track is read in chunks, so it can also
+# be memory-mapped.
+def _plot_gpx_raster(plt, gpx_track, pln_legs):
+    import numpy as np
+    chunks = [gpx_track[x:x+PLOT_RASTER_CHUNK_SIZE] for x in range(0, len(gpx_track), PLOT_RASTER_CHUNK_SIZE)]
+
+    # extent of everything that is plotted with the same margins that matplotlib uses by default
+    min_lat, max_lat = float(np.inf), float(-np.inf)
+    min_lon, max_lon = float(np.inf), float(-np.inf)
+    for track in chunks + list(pln_legs):
+        min_lat, max_lat = min(min_lat, float(np.min(track.get_lats()))), max(max_lat, float(np.max(track.get_lats())))
+        min_lon, max_lon = min(min_lon, float(np.min(track.get_lons()))), max(max_lon, float(np.max(track.get_lons())))
+    margin_lat = max(max_lat - min_lat, PLOT_MINIMUM_EXTENT) * PLOT_MARGIN
+    margin_lon = max(max_lon - min_lon, PLOT_MINIMUM_EXTENT) * PLOT_MARGIN
+    min_lat, max_lat = min_lat - margin_lat, max_lat + margin_lat
+    min_lon, max_lon = min_lon - margin_lon, max_lon + margin_lon
+
+    # one raster cell per few pixels of the axes in the saved image
+    figure = plt.gcf()
+    axes = plt.gca()
+    position = axes.get_position()
+    width = max(1, int(position.width * figure.get_figwidth() * PLOT_DPI / PLOT_RASTER_CELL_SIZE))
+    height = max(1, int(position.height * figure.get_figheight() * PLOT_DPI / PLOT_RASTER_CELL_SIZE))
+
+    # cells with at least one point of the gpx track
+    counts = np.zeros((height, width))
+    for track in chunks:
+        counts += np.histogram2d(track.get_lats(), track.get_lons(), bins=(height, width), range=((min_lat, max_lat), (min_lon, max_lon)))[0]
+    occupied = np.pad(counts > 0, PLOT_RASTER_DOT_RADIUS)
+
+    # grow them to the size of a dot. those cells are gray, all others transparent.
+    dots = np.zeros((height, width), dtype=bool)
+    for dy in range(2 * PLOT_RASTER_DOT_RADIUS + 1):
+        for dx in range(2 * PLOT_RASTER_DOT_RADIUS + 1):
+            dots |= occupied[dy:dy+height, dx:dx+width]
+    image = np.zeros((height, width, 4), dtype=np.float32)
+    image[dots] = (0.5, 0.5, 0.5, 1.0)
+    axes.imshow(image, extent=(min_lon, max_lon, min_lat, max_lat), origin="lower", aspect="auto", interpolation="nearest")
+    axes.set_xlim(min_lon, max_lon)
+    axes.set_ylim(min_lat, max_lat)
+
+# plot the gpx track and the pln legs into a jpg file, given by its name or as a binary file object
+def _plot_gpx_and_pln(gpx_track, pln_legs, fname, raster=False):
+    import matplotlib.pyplot as plt
+
+    # every plot gets its own figure, so many routes can be plotted in one run
+    plt.figure()
+
+    # plot the gpx track as dots or as a raster for long tracks
+    if raster:
+        _plot_gpx_raster(plt, gpx_track, pln_legs)
+    else:
+        plt.plot(gpx_track.get_lons(), gpx_track.get_lats(), color="gray", marker=".", linestyle="none")
+
+    # plot the pln legs
+    for i in range(len(pln_legs)):
+        # plot the pln leg as lines
+        pln_color = "blue" if (i % 2) == 0 else "green"
+        plt.plot(pln_legs[i].get_lons(), pln_legs[i].get_lats(), color=pln_color, marker="o", linestyle="-")
+
+    # save to file
+    plt.savefig(fname, dpi=PLOT_DPI, format="jpg")
+    plt.close()
+
+# title of the flight plan of one leg
+def _leg_title(gpx, counter):
+    title = gpx.get_track_name()
+    if len(title) == 0:
+        title = "Unnamed flight plan"
+    elif len(title) > 30:
+        title = title[:30] + "..."
+    return title + " (" + counter + ")"
+
+# settings of one route. the gpx files are given in order, either by their paths or by their content as bytes,
+# or in any order if they are ordered automatically. the maximum leg length is given in miles and none for not
+# splitting at all. raises a value error for invalid settings.
+def make_route(gpx_files, pln_stem=None, max_leg_length=500, num_leg_points=5, algorithm="douglas-peucker", tolerance=None, smooth=False, reverse=False, auto_order=False):
+    # default tolerance of the algorithm
+    if tolerance is None:
+        import gpx2pln_douglas_peucker
+        tolerance = gpx2pln_douglas_peucker.DEFAULT_TOLERANCE
+
+    # choose a default pln stem
+    gpx_files = list(gpx_files)
+    if len(gpx_files) == 0:
+        raise ValueError("At least one GPX file is required.")
+    if pln_stem is None:
+        if type(gpx_files[0]) != str:
+            raise ValueError("A PLN stem is required for GPX files given as bytes.")
+        pln_stem = os.path.split(gpx_files[0])[-1][:-4]
+
+    # sanity checks
+    if not all(type(x) in (str, bytes) for x in gpx_files):
+        raise ValueError("GPX files are given by their paths or by their content as bytes.")
+    if type(pln_stem) != str or len(pln_stem) == 0:
+        raise ValueError("The PLN stem must not be empty.")
+    if not max_leg_length is None and max_leg_length <= 0:
+        raise ValueError("The maximum leg length has to be positive.")
+    if num_leg_points < 2:
+        raise ValueError("At least two waypoints per leg are required.")
+    if not algorithm in ALGORITHMS:
+        raise ValueError("Unknown algorithm '%s'." % algorithm)
+    if not (math.isfinite(tolerance) and tolerance > 0.0):
+        raise ValueError("The tolerance has to be positive and finite.")
+    return {
+        "gpx_files": gpx_files,
+        "pln_stem": pln_stem,
+        "max_leg_length": max_leg_length,
+        "num_leg_points": num_leg_points,
+        "algorithm": algorithm,
+        "tolerance": tolerance,
+        "smooth": bool(smooth),
+        "reverse": bool(reverse),
+        "auto_order": bool(auto_order)
+    }
+
+class Converter:
+    def __init__(self, airports_fname, jobs=None, cache_dir=None, verbose=False, airport_sources=None):
+        import multiprocessing
+        import threading
+        from gpx2pln_cache import TrackCache
+
+        # the airports database is loaded by the first conversion that needs it
+        self.__airportsFname = airports_fname
+        self.__airportDb = None
+        self.__airportSources = airport_sources
+        self.__verbose = verbose
+
+        # cache of parsed gpx files
+        self.__trackCache = None
+        if not cache_dir is None:
+            self.__trackCache = TrackCache(cache_dir)
+
+        # pool for multi-processing. none for running everything in this process.
+        if not jobs is None and jobs < 1:
+            raise ValueError("The number of jobs has to be positive.")
+        self.__pool = None
+        if jobs != 1:
+            self.__pool = multiprocessing.Pool(jobs)
+
+        # conversions may run in several threads at once. the pool can be shared, but the airports database
+        # and matplotlib are used by one thread at a time.
+        self.__airportLock = threading.Lock()
+        self.__plotLock = threading.Lock()
+
+    def close(self):
+        if not self.__pool is None:
+            self.__pool.close()
+            self.__pool.join()
+            self.__pool = None
+
+    def __print(self, text, end=""):
+        if self.__verbose:
+            print(text, end=end, flush=True)
+
+    def get_airport_db(self):
+        from gpx2pln_airports import AirportDatabase
+        with self.__airportLock:
+            if self.__airportDb is None:
+                self.__airportDb = AirportDatabase(self.__airportsFname, self.__airportSources)
+        return self.__airportDb
+
+    def __find_airports(self, lats, lons):
+        airport_db = self.get_airport_db()
+        with self.__airportLock:
+            return [x[0] for x in airport_db.find_nearest_many(lats, lons)]
+
+    # convert the routes made by make_route(). the pln files and plots are written next to the pln stems, or kept
+    # in memory and returned as bytes. returns one dictionary per route with the concatenated gpx files, the legs
+    # of the flight plan, the files kept in memory by their names and the number of points.
+    def convert(self, routes, plot=True, raster_plot=False, in_memory=False, profile=None, incremental=False):
+        return list(self.iter_convert(routes, plot, raster_plot, in_memory, profile, incremental))
+
+    # same as convert(), but every route is handed out as soon as it is finished. the stages are generators: the
+    # gpx files of later routes are read in the pool while earlier ones are converted, and every pln file is
+    # written in the pool as soon as its leg is chosen, while the next legs are still simplified.
+    # incrementally, the state of the conversion is kept next to the pln files and only the legs that overlap gpx
+    # files which changed since the last conversion are planned again, see gpx2pln_incremental.py.
+    def iter_convert(self, routes, plot=True, raster_plot=False, in_memory=False, profile=None, incremental=False):
+        import itertools
+        import shutil
+        import tempfile
+        from gpx2pln_gpx import GpxConcat
+        if profile is None:
+            profile = gpx2pln_profile.StageProfile()
+        assert not incremental or not in_memory
+        assert not incremental or not any(x["smooth"] for x in routes), "Smoothing is not supported incrementally."
+
+        # load the airports database first, the legs look up their airports one by one
+        self.get_airport_db()
+
+        # read the gpx files of all routes ahead in the pool
+        gpx_files = [x for route in routes for x in route["gpx_files"]]
+        track_dir = None
+        tasks = [(x, None, self.__trackCache) for x in gpx_files]
+        if not self.__pool is None and not in_memory:
+            # the tracks are handed back in files. in memory they are pickled instead, so nothing touches the disk.
+            track_dir = tempfile.mkdtemp(prefix="gpx2pln_")
+            tasks = [(gpx_files[i], os.path.join(track_dir, "%i.track" % i), self.__trackCache) for i in range(len(gpx_files))]
+        gpx_raw = _imap(self.__pool, _worker_gpx_fname_to_obj, tasks)
+        try:
+            for route in routes:
+                self.__print("Converting %s... " % os.path.basename(route["pln_stem"]))
+                with profile.stage("gpx_read", len(route["gpx_files"])):
+                    gpx_files = list(itertools.islice(gpx_raw, len(route["gpx_files"])))
+                    names = [route["gpx_files"][i] for i in range(len(gpx_files)) if not gpx_files[i] is None]
+                    gpx_files = [x for x in gpx_files if not x is None]
+                    if len(gpx_files) == 0:
+                        raise EmptyRouteError("No GPX file of %s has a track with at least two distinct points." % os.path.basename(route["pln_stem"]))
+                    if not track_dir is None:
+                        for x in gpx_files:
+                            x.load_track_from_file()
+                with profile.stage("concat") as stage:
+                    gpx = GpxConcat(gpx_files, auto_order=route["auto_order"])
+                    names = [names[i] for i in gpx.get_order()]
+                    gpx_files = [gpx_files[i] for i in gpx.get_order()]
+                    if route["reverse"]:
+                        gpx.reverse()
+                    stage["num_items"] = len(gpx)
+                result = {"gpx": gpx, "legs": None, "files": dict(), "num_points": len(gpx)}
+
+                # choose the legs and write them. incrementally, the state is removed until all pln files are written.
+                if incremental:
+                    import gpx2pln_incremental
+                    state_fname = gpx2pln_incremental.state_fname(route["pln_stem"])
+                    state = gpx2pln_incremental.read_state(state_fname)
+                    header = gpx2pln_incremental.make_header(route, gpx)
+                    files = gpx2pln_incremental.make_files(names, gpx_files, gpx.get_reversals(), route["reverse"])
+                    plan = gpx2pln_incremental.plan_legs(state, header, files, len(gpx))
+                    if os.path.isfile(state_fname):
+                        os.remove(state_fname)
+                    bounds = list()
+                    num_written = self.__write_legs(route, gpx, _iter_planned_legs(gpx.get_track_coords(), route, plan, LEG_CHUNK_SIZE, bounds), in_memory, profile, result)
+
+                    # remove the pln files of legs that do not exist anymore and keep the new state
+                    if not state is None:
+                        for i in range(len(result["legs"]), len(state["legs"])):
+                            fname = route["pln_stem"] + "_" + str(i+1) + ".pln"
+                            if os.path.isfile(fname):
+                                os.remove(fname)
+                    legs = [{"start": x[0], "end": x[1], "waypoints": [[float(lat), float(lon)] for lat, lon in zip(leg.get_lats(), leg.get_lons())]} for x, leg in zip(bounds, result["legs"])]
+                    gpx2pln_incremental.write_state(state_fname, header, files, legs)
+                    summary = "Wrote %i of %i PLN file(s)!" % (num_written, len(result["legs"]))
+                    plot_route = plot and (num_written > 0 or not os.path.isfile(route["pln_stem"] + ".jpg"))
+                else:
+                    legs = ((x, route["algorithm"], True) for x in _iter_legs(gpx.get_track_coords(), route, LEG_CHUNK_SIZE))
+                    self.__write_legs(route, gpx, legs, in_memory, profile, result)
+                    summary = None
+                    plot_route = plot
+                del gpx_files
+
+                # plot the result if requested
+                if plot_route:
+                    import io
+                    fname = io.BytesIO() if in_memory else route["pln_stem"] + ".jpg"
+                    with profile.stage("plot", len(gpx)), self.__plotLock:
+                        _plot_gpx_and_pln(gpx.get_track_coords(), result["legs"], fname, raster_plot)
+                    if in_memory:
+                        result["files"][route["pln_stem"] + ".jpg"] = fname.getvalue()
+                self.__print("done!", end="\n")
+                if not summary is None:
+                    self.__print(summary, end="\n")
+                yield result
+        finally:
+            # the concatenated tracks are copies, so the files are not needed anymore
+            gpx_raw.close()
+            if not track_dir is None:
+                shutil.rmtree(track_dir, ignore_errors=True)
+
+    # look up the airports of every leg as soon as it is chosen and write its pln file in the pool. the legs are
+    # given with the algorithm for choosing their waypoints and whether to write them at all. the files are named
+    # after the position of the leg, so the result does not depend on the order in which the legs are finished.
+    # returns the number of written pln files.
+    def __write_legs(self, route, gpx, legs, in_memory, profile, result):
+        import collections
+        description = gpx.get_track_name() + " by " + gpx.get_author_name()
+        chosen = dict() # waypoints of the legs by their position
+        positions = collections.deque() # positions of the legs in the pool
+        def tasks():
+            for i, (leg, algorithm, write) in enumerate(legs):
+                if not write:
+                    chosen[i] = leg
+                    continue
+                departure_airport, destination_airport = self.__find_airports([leg.get_lats()[0], leg.get_lats()[-1]], [leg.get_lons()[0], leg.get_lons()[-1]])
+                counter = str(i+1)
+                fname = None if in_memory else route["pln_stem"] + "_" + counter + ".pln"
+                positions.append(i)
+                yield (algorithm, leg, route["num_leg_points"], fname, _leg_title(gpx, counter), description, gpx.get_max_elevation(), departure_airport, destination_airport)
+        with profile.stage("legs") as stage:
+            num_written = 0
+            for leg, data in _imap(self.__pool, _worker_leg_to_pln, tasks()):
+                i = positions.popleft()
+                chosen[i] = leg
+                num_written += 1
+                if in_memory:
+                    result["files"][route["pln_stem"] + "_" + str(i+1) + ".pln"] = data
+            result["legs"] = [chosen[i] for i in range(len(chosen))]
+            stage["num_items"] = num_written
+        assert len(result["legs"]) > 0
+        return num_written
+
+    # convert the routes made by make_route() without ever having the whole track of a route in memory. the gpx
+    # files are read in order and spilled to memory-mapped files in the scratch directory, the track is simplified
+    # and split chunk by chunk and every pln file is written as soon as its leg is complete. the results are the same
+    # as with convert(), but the routes are converted one after another, the plots are always rasters and smoothing
+    # is not supported. the results hold no gpx files, only the number of points.
+    # HINT: every gpx file is still parsed, stitched and cached as a whole before it is spilled, so the memory grows
+    # with the largest gpx file of a route.
+    def convert_out_of_core(self, routes, plot=True, scratch_dir=None, chunk_size=DEFAULT_CHUNK_SIZE, profile=None):
+        import shutil
+        import tempfile
+        if profile is None:
+            profile = gpx2pln_profile.StageProfile()
+        assert chunk_size > 0
+        assert not any(x["smooth"] for x in routes), "Smoothing is not supported out of core."
+
+        # load the airports database first, the legs look up their airports one by one
+        self.get_airport_db()
+
+        # every route gets its own scratch files, they are removed as soon as possible
+        scratch_dir = tempfile.mkdtemp(prefix="gpx2pln_", dir=scratch_dir)
+        try:
+            results = list()
+            for i in range(len(routes)):
+                route_dir = os.path.join(scratch_dir, str(i))
+                os.mkdir(route_dir)
+                results.append(self.__convert_route_out_of_core(routes[i], route_dir, plot, chunk_size, profile))
+                shutil.rmtree(route_dir, ignore_errors=True)
+        finally:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+        return results
+
+    def __convert_route_out_of_core(self, route, scratch_dir, plot, chunk_size, profile):
+        import numpy as np
+        from gpx2pln_chain import chain_tracks
+        from gpx2pln_gpx import GpxConcat, choose_reversals
+        from gpx2pln_track import TrackWriter
+
+        # read the gpx files. the track of every file goes to a file of its own right away.
+        self.__print("Converting %s... " % os.path.basename(route["pln_stem"]))
+        tasks = [(route["gpx_files"][i], os.path.join(scratch_dir, "%i.track" % i), self.__trackCache) for i in range(len(route["gpx_files"]))]
+        with profile.stage("gpx_read", len(tasks)):
+            gpx_files = [x for x in _imap(self.__pool, _worker_gpx_fname_to_obj, tasks) if not x is None]
+            for x in gpx_files:
+                x.load_track_from_file()
+        if len(gpx_files) == 0:
+            raise EmptyRouteError("No GPX file of %s has a track with at least two distinct points." % os.path.basename(route["pln_stem"]))
+
+        # concatenate into one memory-mapped track. the order and the orientation of the files only depend on their
+        # ends. reversing the route reverses the order of the files and every file.
+        with profile.stage("concat") as stage:
+            tracks = [x.get_track_coords() for x in gpx_files]
+            if route["auto_order"]:
+                order, chained = chain_tracks(tracks)
+                reverse = [False] * len(tracks)
+                for i, is_reversed in zip(order, chained):
+                    reverse[i] = is_reversed
+                gpx_files = [gpx_files[i] for i in order]
+            else:
+                order = range(len(tracks))
+                reverse = choose_reversals(tracks)
+            if route["reverse"]:
+                order = order[::-1]
+                reverse = [not x for x in reverse]
+            writer = TrackWriter(os.path.join(scratch_dir, "route"), any(not x.get_elevations() is None for x in tracks), any(not x.get_times() is None for x in tracks))
+            for i in order:
+                for start in range(0, len(tracks[i]), chunk_size):
+                    if reverse[i]:
+                        end = len(tracks[i]) - start
+                        writer.append(tracks[i].take(np.arange(end - 1, max(end - chunk_size, 0) - 1, -1)))
+                    else:
+                        writer.append(tracks[i][start:start+chunk_size])
+            gpx = GpxConcat(gpx_files, writer.finish())
+            del tracks
+            stage["num_items"] = len(gpx)
+
+        # choose the legs while going along the track and write them
+        result = {"gpx": None, "legs": None, "files": dict(), "num_points": len(gpx)}
+        legs = ((x, route["algorithm"], True) for x in _iter_legs(gpx.get_track_coords(), route, chunk_size, in_memory=False))
+        self.__write_legs(route, gpx, legs, False, profile, result)
+
+        # plot the result if requested
+        if plot:
+            with profile.stage("plot", len(gpx)), self.__plotLock:
+                _plot_gpx_and_pln(gpx.get_track_coords(), result["legs"], route["pln_stem"] + ".jpg", raster=True)
+        self.__print("done!", end="\n")
+
+        # finished
+        return result
@@ -1,53 +1,43 @@
-import LatLon23
 import numpy as np
-import skimage.measure
+import gpx2pln_geo
+import gpx2pln_legs
+import gpx2pln_simplify
+from gpx2pln_track import Track
 
-def douglas_peucker(coords, max_leg_length):
-    # convert to a numpy array
-    np_coords = np.empty((len(coords),2), dtype=np.float32)
-    for i in range(len(coords)):
-        np_coords[i,0] = float(coords[i].lat)
-        np_coords[i,1] = float(coords[i].lon)
-    
-    # subdivide the polygon
-    for _ in range(5):
+DEFAULT_TOLERANCE = 10.0 # in kilometers
+NUM_SMOOTHING_PASSES = 5 # each pass doubles the number of points
+
+# smooth the track by subdividing the polygon. this creates new points.
+def _smooth(track):
+    import skimage.measure
+    np_coords = np.column_stack((track.get_lats(), track.get_lons()))
+    for _ in range(NUM_SMOOTHING_PASSES):
         np_coords = skimage.measure.subdivide_polygon(np_coords, degree=2, preserve_ends=True)
+    return Track(np_coords[:,0], np_coords[:,1])
+
+def split_legs(track, max_leg_length, tolerance=DEFAULT_TOLERANCE, smooth=False):
+    # smooth the track if requested
+    if smooth:
+        track = _smooth(track)
     
     # approximate the polygon
-    np_coords = skimage.measure.approximate_polygon(np_coords, tolerance=0.1)
-
-    # convert back
-    coords = list()
-    for i in range(np_coords.shape[0]):
-        c = LatLon23.LatLon(float(np_coords[i,0]), float(np_coords[i,1]))
-        coords.append(c)
+    track = track.take(gpx2pln_simplify.douglas_peucker_indices(track.get_lats(), track.get_lons(), tolerance))
     
     # split into legs
-    legs = list()
-    cur_leg = [coords[0]]
-    cur_len = 0.0
-    for c in coords[1:]:
-        assert type(c) == LatLon23.LatLon
-        last_coord = cur_leg[-1]
-        last_dist = c.distance(last_coord)
-        new_len = cur_len + last_dist
-        if new_len > max_leg_length:
-            new_over = new_len - max_leg_length
-            cur_under = max_leg_length - cur_len
-            if new_over < cur_under:
-                cur_leg.append(c)
-                legs.append(cur_leg)
-                cur_leg = [c]
-                cur_len = 0.0
-            else:
-                legs.append(cur_leg)
-                cur_leg = [last_coord, c]
-                cur_len = last_dist
-        else:
-            cur_len = new_len
-            cur_leg.append(c)
-    if len(cur_leg) > 1:
-        legs.append(cur_leg)
-    
-    # finished
-    return legs
\ No newline at end of file
+    ranges = gpx2pln_legs.leg_ranges(gpx2pln_geo.cumulative_distance(track.get_lats(), track.get_lons()), max_leg_length)
+    return track, ranges
+
+def iter_leg_indices(track, max_leg_length, chunk_size, tolerance=DEFAULT_TOLERANCE, in_memory=True):
+    # indices of the points of the same legs as split_legs() without smoothing, handed out as soon as the legs are
+    # complete. the track is simplified chunk by chunk, so it does not have to fit into memory.
+    lats = track.get_lats()
+    lons = track.get_lons()
+    index_blocks = gpx2pln_simplify.iter_douglas_peucker_indices(lats, lons, tolerance, chunk_size, in_memory)
+    return gpx2pln_legs.iter_leg_indices(lats, lons, index_blocks, max_leg_length)
+
+def iter_legs(track, max_leg_length, chunk_size, tolerance=DEFAULT_TOLERANCE, smooth=False, in_memory=True):
+    # the smoothed track has to fit into memory
+    if smooth:
+        track = _smooth(track)
+    for indices in iter_leg_indices(track, max_leg_length, chunk_size, tolerance, in_memory):
+        yield track.take(indices)
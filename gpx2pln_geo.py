@@ -0,0 +1,48 @@
+import numpy as np
+import pyproj
+import gpx2pln_profile
+
+# batched calculations with geo-coordinates. all coordinates are given in degree as scalars or numpy arrays,
+# all distances are returned in kilometers.
+
+EARTH_RADIUS = 6371.0 # in kilometers, mean radius as used by the fai sphere
+
+# same ellipsoid that LatLon23 uses by default, so results are identical to LatLon.distance() and friends
+_GEOD = pyproj.Geod(ellps="WGS84")
+
+def _inverse(lats_A, lons_A, lats_B, lons_B):
+    # broadcast everything to float64 arrays of the same shape
+    lats_A, lons_A, lats_B, lons_B = np.broadcast_arrays(
+        np.asarray(lats_A, dtype=np.float64), np.asarray(lons_A, dtype=np.float64),
+        np.asarray(lats_B, dtype=np.float64), np.asarray(lons_B, dtype=np.float64))
+    gpx2pln_profile.count("geodesic_evaluations", lats_A.size)
+    heading_initial, _, distance = _GEOD.inv(lons_A, lats_A, lons_B, lats_B)
+    return np.asarray(heading_initial), np.asarray(distance) / 1000.0
+
+# geodesic distance on the wgs84 ellipsoid
+def distance(lats_A, lons_A, lats_B, lons_B):
+    dist = _inverse(lats_A, lons_A, lats_B, lons_B)[1]
+    return float(dist) if dist.ndim == 0 else dist
+
+# initial heading in degree from a to b on the wgs84 ellipsoid
+def heading_initial(lats_A, lons_A, lats_B, lons_B):
+    heading = _inverse(lats_A, lons_A, lats_B, lons_B)[0]
+    return float(heading) if heading.ndim == 0 else heading
+
+# distances between consecutive points of a track
+def segment_distances(lats, lons):
+    if len(lats) < 2:
+        return np.zeros(0, dtype=np.float64)
+    return _inverse(lats[:-1], lons[:-1], lats[1:], lons[1:])[1]
+
+# distance along the track for every point, starting with zero
+def cumulative_distance(lats, lons):
+    cum_dist = np.zeros(len(lats), dtype=np.float64)
+    np.cumsum(segment_distances(lats, lons), out=cum_dist[1:])
+    return cum_dist
+
+# smallest distance between one point and any of the given points
+def minimal_distance(lat, lon, lats, lons):
+    if len(lats) == 0:
+        return np.inf
+    return float(np.min(_inverse(lat, lon, lats, lons)[1]))
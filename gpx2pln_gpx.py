@@ -1,107 +1,155 @@
 import xml.etree.ElementTree
-import LatLon23
-import copy
+import array
+import datetime
+import io
+import numpy as np
+import gpx2pln_cache
+import gpx2pln_geo
+import gpx2pln_profile
+import gpx2pln_spatial
+import gpx2pln_track
+from gpx2pln_track import Track
 
 # DISCLAIMER: I didn't study the GPX file format. I've downloaded a few that are freely available and did 'learning by doing'.
 #             Feel free to improve this! :-)
 
+GPX_PARSER_VERSION = 1 # increase whenever reading or choosing track segments changes, invalidates cached results
 MINIMUM_TRACK_SEGMENT_LENGTH = 10.0 # in kilometers
 MAXIMUM_DISTANCE_BETWEEN_SEGMENTS = 50.0 # in kilometers
 
-def _length_of_track_segment(track_point_nodes, xml_namespace):
+def _length_of_track_segment(track):
     # sum up the distance
-    distance = 0.0
-    for i in range(1, len(track_point_nodes)):
-        # current node
-        lat = LatLon23.Latitude(float(track_point_nodes[i].attrib["lat"]))
-        lon = LatLon23.Longitude(float(track_point_nodes[i].attrib["lon"]))
-        cur = LatLon23.LatLon(lat, lon)
-
-        # previous node
-        lat = LatLon23.Latitude(float(track_point_nodes[i-1].attrib["lat"]))
-        lon = LatLon23.Longitude(float(track_point_nodes[i-1].attrib["lon"]))
-        prev = LatLon23.LatLon(lat, lon)
-
-        # add the distance
-        distance += cur.distance(prev)
-    
-    # finished
-    return distance
-
-def _heading_of_track_segment(track_point_nodes, xml_namespace):
-    # first node
-    lat = LatLon23.Latitude(float(track_point_nodes[0].attrib["lat"]))
-    lon = LatLon23.Longitude(float(track_point_nodes[0].attrib["lon"]))
-    start = LatLon23.LatLon(lat, lon)
-
-    # last node
-    lat = LatLon23.Latitude(float(track_point_nodes[-1].attrib["lat"]))
-    lon = LatLon23.Longitude(float(track_point_nodes[-1].attrib["lon"]))
-    end = LatLon23.LatLon(lat, lon)
-
-    # heading calculation and finish
-    return start.heading_initial(end)
-
-def _distance_between_points(track_point_node_A, track_point_node_B):
-    # first node
-    lat = LatLon23.Latitude(float(track_point_node_A.attrib["lat"]))
-    lon = LatLon23.Longitude(float(track_point_node_A.attrib["lon"]))
-    coord_A = LatLon23.LatLon(lat, lon)
-
-    # second node
-    lat = LatLon23.Latitude(float(track_point_node_B.attrib["lat"]))
-    lon = LatLon23.Longitude(float(track_point_node_B.attrib["lon"]))
-    coord_B = LatLon23.LatLon(lat, lon)
-
-    # finished
-    return coord_A.distance(coord_B)
-
-def _minimal_distance_to_track(new_point, existing_segment):
-    # first node
-    lat = LatLon23.Latitude(float(new_point.attrib["lat"]))
-    lon = LatLon23.Longitude(float(new_point.attrib["lon"]))
-    new_coord = LatLon23.LatLon(lat, lon)
-    
-    # find the minimum distance
-    min_dist = 999999.999
-    for node in existing_segment:
-        # existing node
-        lat = LatLon23.Latitude(float(node.attrib["lat"]))
-        lon = LatLon23.Longitude(float(node.attrib["lon"]))
-        existing_coord = LatLon23.LatLon(lat, lon)
-
-        # distance
-        dist = existing_coord.distance(new_coord)
-        min_dist = min(min_dist, dist)
+    return float(np.sum(gpx2pln_geo.segment_distances(track.get_lats(), track.get_lons())))
+
+def _heading_of_track_segment(track):
+    # heading from the first to the last point
+    return gpx2pln_geo.heading_initial(track.get_lats()[0], track.get_lons()[0], track.get_lats()[-1], track.get_lons()[-1])
+
+def _distance_between_coords(track_A, idx_A, track_B, idx_B):
+    return gpx2pln_geo.distance(track_A.get_lats()[idx_A], track_A.get_lons()[idx_A], track_B.get_lats()[idx_B], track_B.get_lons()[idx_B])
+
+def _parse_time(text):
+    # iso 8601 timestamp to seconds since the epoch. nan if not parseable.
+    try:
+        dtime = datetime.datetime.fromisoformat(text.strip().replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        return np.nan
+    if dtime.tzinfo is None:
+        dtime = dtime.replace(tzinfo=datetime.timezone.utc)
+    return dtime.timestamp()
+
+def _segment_to_track(lats, lons, elevations, times):
+    # the optional values are dropped if they are not present at all
+    elevations = np.frombuffer(elevations, dtype=np.float64)
+    if np.all(np.isnan(elevations)):
+        elevations = None
+    times = np.frombuffer(times, dtype=np.float64)
+    if np.all(np.isnan(times)):
+        times = None
+    return Track(np.frombuffer(lats, dtype=np.float64), np.frombuffer(lons, dtype=np.float64), elevations, times)
+
+def _read_gpx(fname):
+    # the content of the file can also be given as bytes
+    if type(fname) == bytes:
+        fname = io.BytesIO(fname)
+
+    # to be filled now...
+    metadata = {
+        "track_links": set(),
+        "author_links": set()
+    }
+    track_segments = list()
+
+    # the namespace is taken from the root node
+    xml_prefix = None
+
+    # stream through the xml file. consumed nodes are removed immediately to keep the memory bounded.
+    path = list() # local names of the currently open nodes
+    nodes = list() # currently open nodes
+    seg_values = None # arrays of the current track segment
+    point_ele = np.nan
+    point_time = np.nan
+    num_nodes = 0
+    for event, node in xml.etree.ElementTree.iterparse(fname, events=("start", "end")):
+        # root node?
+        if xml_prefix is None:
+            xml_prefix = node.tag.split("}")[0] + "}" if node.tag.startswith("{") else ""
+
+        # local name of the node. nodes from other namespaces are ignored.
+        if not node.tag.startswith(xml_prefix):
+            name = None
+        else:
+            name = node.tag[len(xml_prefix):]
+
+        # opening nodes
+        if event == "start":
+            path.append(name)
+            nodes.append(node)
+            if path[1:] == ["trk", "trkseg"]:
+                seg_values = (array.array("d"), array.array("d"), array.array("d"), array.array("d"))
+            elif path[1:] == ["trk", "trkseg", "trkpt"]:
+                point_ele = np.nan
+                point_time = np.nan
+            continue
+
+        # closing nodes
+        if path[1:] == ["trk", "trkseg", "trkpt", "ele"]:
+            point_ele = float(node.text)
+        elif path[1:] == ["trk", "trkseg", "trkpt", "time"]:
+            point_time = _parse_time(node.text)
+        elif path[1:] == ["trk", "trkseg", "trkpt"]:
+            seg_values[0].append(float(node.attrib["lat"]))
+            seg_values[1].append(float(node.attrib["lon"]))
+            seg_values[2].append(point_ele)
+            seg_values[3].append(point_time)
+        elif path[1:] == ["trk", "trkseg"]:
+            track_segments.append(_segment_to_track(*seg_values))
+            seg_values = None
+        elif path[1:] == ["metadata", "name"] and not "track_name" in metadata:
+            metadata["track_name"] = node.text
+        elif path[1:] == ["metadata", "link"]:
+            metadata["track_links"].add(node.attrib["href"])
+        elif path[1:] == ["metadata", "author", "name"] and not "author_name" in metadata:
+            metadata["author_name"] = node.text
+        elif path[1:] == ["metadata", "author", "link"]:
+            metadata["author_links"].add(node.attrib["href"])
+
+        # forget about the consumed node
+        path.pop()
+        nodes.pop()
+        if len(nodes) > 0:
+            nodes[-1].remove(node)
+        num_nodes += 1
     
     # finished
-    return min_dist
+    gpx2pln_profile.count("xml_nodes_parsed", num_nodes)
+    return metadata, track_segments
 
 
-def _choose_track_point_nodes(track_segment_nodes, xml_namespace):
+def _choose_track_segments(track_segments):
     # collect possible segments
     segments = list()
-    for node in track_segment_nodes:
-        # find all track points
-        track_point_nodes = node.findall("trkpt", xml_namespace)
-        
+    for track in track_segments:
+        # too short to tell anything?
+        if len(track) < 2:
+            continue
+
         # info about the forward track
-        cur_len = _length_of_track_segment(track_point_nodes, xml_namespace)
-        cur_heading = _heading_of_track_segment(track_point_nodes, xml_namespace)
+        cur_len = _length_of_track_segment(track)
+        cur_heading = _heading_of_track_segment(track)
         
         # info about the reverse track
-        rev_nodes = copy.deepcopy(track_point_nodes)
-        rev_nodes.reverse()
-        rev_heading = _heading_of_track_segment(rev_nodes, xml_namespace)
+        rev_track = track[::-1]
+        rev_heading = _heading_of_track_segment(rev_track)
 
         # add the track segments that are long enough
         if cur_len > MINIMUM_TRACK_SEGMENT_LENGTH:
-            segments.append((track_point_nodes, cur_len, cur_heading))
-            segments.append((rev_nodes, cur_len, rev_heading))
+            segments.append((track, cur_len, cur_heading))
+            segments.append((rev_track, cur_len, rev_heading))
     
     # no segments at all?
     if len(segments) == 0:
-        return list()
+        return None
     
     # start with the longest segment
     max_length = 0
@@ -110,44 +158,62 @@ def _choose_track_point_nodes(track_segment_nodes, xml_namespace):
         if segments[i][1] > max_length:
             max_length = segments[i][1]
             max_idx = i
-    res_nodes = segments[max_idx][0]
-    del segments[max_idx]
+    used = [False] * len(segments)
+    used[max_idx] = True
+    res_first = segments[max_idx][0]
+    res_last = segments[max_idx][0]
+    prepend_tracks = list()
+    append_tracks = list()
+
+    # spatial index over the points that are already part of the result
+    res_index = gpx2pln_spatial.PolylineIndex()
+    res_index.add(segments[max_idx][0].get_lats(), segments[max_idx][0].get_lons())
+
+    # spatial index over the start and end points of all segments. scipy is only needed for files with several segments.
+    import scipy.spatial
+    start_tree = scipy.spatial.cKDTree(gpx2pln_spatial.to_xyz([x[0].get_lats()[0] for x in segments], [x[0].get_lons()[0] for x in segments]))
+    end_tree = scipy.spatial.cKDTree(gpx2pln_spatial.to_xyz([x[0].get_lats()[-1] for x in segments], [x[0].get_lons()[-1] for x in segments]))
+    search_radius = gpx2pln_spatial.chord_radius(MAXIMUM_DISTANCE_BETWEEN_SEGMENTS)
+
+    # how much the segments add. the minimal distance to the result can only shrink when the result grows,
+    # so we remember the value together with the number of blocks of the index that have been checked.
+    add_cache = dict()
 
     # add more segments if they actually add distance
     while True:
         best_add = MINIMUM_TRACK_SEGMENT_LENGTH
         best_idx = None
         best_at_end = True
-        for i in range(len(segments)):
+
+        # only segments starting near the current end or ending near the current start can be candidates
+        cands = set(start_tree.query_ball_point(gpx2pln_spatial.to_xyz(res_last.get_lats()[-1], res_last.get_lons()[-1]), search_radius))
+        cands.update(end_tree.query_ball_point(gpx2pln_spatial.to_xyz(res_first.get_lats()[0], res_first.get_lons()[0]), search_radius))
+        for i in sorted(cands):
+            if used[i]:
+                continue
+
             # distance between the new segment and the current end
-            dist_end = _distance_between_points(res_nodes[-1], segments[i][0][0])
+            dist_end = _distance_between_coords(res_last, -1, segments[i][0], 0)
 
             # distance between the new segment and the current start
-            dist_start = _distance_between_points(segments[i][0][-1], res_nodes[0])
+            dist_start = _distance_between_coords(segments[i][0], -1, res_first, 0)
 
             # is this a candidate?
             if not min(dist_end, dist_start) < MAXIMUM_DISTANCE_BETWEEN_SEGMENTS:
                 continue
 
-            # different cases for prepending or appending
-            if dist_end < dist_start:
-                # how much does it add?
-                add_dist = _minimal_distance_to_track(segments[i][0][-1], res_nodes)
-
-                # use if best so far
-                if add_dist > best_add:
-                    best_add = add_dist
-                    best_idx = i
-                    best_at_end = True
-            else:
-                # how much does it add?
-                add_dist = _minimal_distance_to_track(segments[i][0][0], res_nodes)
-
-                # use if best so far
-                if add_dist > best_add:
-                    best_add = add_dist
-                    best_idx = i
-                    best_at_end = False                    
+            # how much does it add? different cases for prepending or appending.
+            at_end = dist_end < dist_start
+            point_idx = -1 if at_end else 0
+            add_dist, num_checked = add_cache.get((i, at_end), (np.inf, 0))
+            add_dist = res_index.minimal_distance(segments[i][0].get_lats()[point_idx], segments[i][0].get_lons()[point_idx], num_checked, add_dist)
+            add_cache[(i, at_end)] = (add_dist, len(res_index))
+
+            # use if best so far
+            if add_dist > best_add:
+                best_add = add_dist
+                best_idx = i
+                best_at_end = at_end
         
         # nothing more found?
         if best_idx is None:
@@ -155,79 +221,84 @@ def _choose_track_point_nodes(track_segment_nodes, xml_namespace):
 
         # add the segment
         if best_at_end:
-            append_nodes = segments[best_idx][0]
-            res_nodes = res_nodes + append_nodes
+            append_track = segments[best_idx][0]
+            append_tracks.append(append_track)
+            res_last = append_track
         else:
-            prepend_nodes = segments[best_idx][0]
-            res_nodes = prepend_nodes + res_nodes
+            prepend_track = segments[best_idx][0]
+            prepend_tracks.append(prepend_track)
+            res_first = prepend_track
+        res_index.add(segments[best_idx][0].get_lats(), segments[best_idx][0].get_lons())
         
         # delete from candidates
-        del segments[best_idx]
+        used[best_idx] = True
 
     # finished
-    return res_nodes
-
-# representation of a single .gpx file
+    return gpx2pln_track.concatenate(prepend_tracks[::-1] + [segments[max_idx][0]] + append_tracks)
+
+# which tracks to reverse to get one continuous track. only the first and the last point of every track are read.
+def choose_reversals(tracks):
+    reverse = [False] * len(tracks)
+    if len(tracks) > 1:
+        # reverse the first track if necessary
+        start_dist = _distance_between_coords(tracks[0], 0, tracks[1], 0)
+        end_dist = _distance_between_coords(tracks[0], -1, tracks[1], 0)
+        reverse[0] = start_dist < end_dist
+        
+        # reverse all the others if necessary
+        for i in range(1, len(tracks)):
+            prev_end = 0 if reverse[i-1] else -1
+            start_dist = _distance_between_coords(tracks[i], 0, tracks[i-1], prev_end)
+            end_dist = _distance_between_coords(tracks[i], -1, tracks[i-1], prev_end)
+            reverse[i] = end_dist < start_dist
+    return reverse
+
+# representation of a single .gpx file, given by its path or by its content as bytes
 class GpxFile:
-    def __init__(self, fname):
+    def __init__(self, fname, cache=None):
         # to be filled now...
         self.__authorName = "Unknown author"
         self.__authorLinks = set() # all links associated with the author
         self.__trackName = "Unnamed track"
         self.__trackLinks = set() # all links associated with the track in general
-        self.__trackCoords = list()
+        self.__track = Track(np.empty(0), np.empty(0))
+        self.__trackFile = None # descriptor of the track while it is stored in a file
         self.__maxElevation = None # maximum elevation in feet. none if unknown.
 
-        # read and parse the xml file
-        xml_data = xml.etree.ElementTree.parse(fname)
-        xml_root = xml_data.getroot()
-        xml_namespace = xml_root.tag.split("}")[0].strip("{}")
-        xml_namespace = {
-            "": xml_namespace
-        }
+        # the content is identified by its hash, e.g. to notice changes since an earlier run
+        self.__contentKey = gpx2pln_cache.content_key(fname, GPX_PARSER_VERSION)
+
+        # reuse the result of an earlier run if possible
+        cached = None
+        if not cache is None:
+            cached = cache.load(self.__contentKey)
         
-        # collect the metadata
-        track_name_node = xml_data.find("./metadata/name", xml_namespace)
-        if not track_name_node is None:
-            self.__trackName = track_name_node.text
-        track_link_nodes = xml_data.findall("./metadata/link", xml_namespace)
-        for node in track_link_nodes:
-            self.__trackLinks.add(node.attrib["href"])
-        author_name_node = xml_data.find("./metadata/author/name", xml_namespace)
-        if not author_name_node is None:
-            self.__authorName = author_name_node.text
-        author_link_nodes = xml_data.findall("./metadata/author/link", xml_namespace)
-        for node in author_link_nodes:
-            self.__authorLinks.add(node.attrib["href"])
+        # read and parse the xml file and choose track segments otherwise
+        if not cache is None:
+            gpx2pln_profile.count("track_cache_misses" if cached is None else "track_cache_hits")
+        if cached is None:
+            metadata, track_segments = _read_gpx(fname)
+            track = _choose_track_segments(track_segments)
+            if not cache is None:
+                cache.store(self.__contentKey, metadata, self.__track if track is None else track)
+        else:
+            metadata, track = cached
         
-        # choose track point nodes
-        track_point_nodes = _choose_track_point_nodes(xml_data.findall("./trk/trkseg", xml_namespace), xml_namespace)
+        # collect the metadata
+        if "track_name" in metadata:
+            self.__trackName = metadata["track_name"]
+        self.__trackLinks.update(metadata["track_links"])
+        if "author_name" in metadata:
+            self.__authorName = metadata["author_name"]
+        self.__authorLinks.update(metadata["author_links"])
         
         # collect the track coordinates
-        if len(track_point_nodes) > 1:
-            for node in track_point_nodes:
-                # raw coordinates as strings
-                lat = node.attrib["lat"]
-                lon = node.attrib["lon"]
-
-                # parse the coordinates
-                lat = LatLon23.Latitude(float(lat))
-                lon = LatLon23.Longitude(float(lon))
-                coord = LatLon23.LatLon(lat, lon)
-
-                # append the coordinates
-                self.__trackCoords.append(coord)
-
-                # elevation in this point?
-                elevation_node = node.find("ele", xml_namespace)
-                if not elevation_node is None:
-                    if self.__maxElevation is None:
-                        self.__maxElevation = 0.0
-                    elevation = float(elevation_node.text)
-                    self.__maxElevation = max(self.__maxElevation, elevation)
+        if not track is None and len(track) > 1:
+            self.__track = track
+            self.__maxElevation = self.__track.get_max_elevation()
     
     def __len__(self):
-        return len(self.__trackCoords)
+        return len(self.__track)
     
     def get_author_name(self):
         return self.__authorName
@@ -242,59 +313,79 @@ class GpxFile:
         return self.__trackLinks
     
     def get_track_coords(self):
-        return self.__trackCoords
+        return self.__track
     
     def get_max_elevation(self):
         return self.__maxElevation
     
+    def get_content_key(self):
+        return self.__contentKey
+    
     def reverse(self):
-        self.__trackCoords.reverse()
-
-# concatenation of multiple .gpx files
+        self.__track.reverse()
+    
+    def move_track_to_file(self, fname):
+        # store the track in a file so that this object can be sent to another process without it
+        self.__trackFile = gpx2pln_track.save_to_file(self.__track, fname)
+        self.__track = None
+    
+    def load_track_from_file(self):
+        # memory-map the track stored by move_track_to_file()
+        self.__track = gpx2pln_track.load_from_file(self.__trackFile)
+        self.__trackFile = None
+
+# concatenation of multiple .gpx files. the concatenated track can also be given if it was built elsewhere, e.g. out
+# of core, then only the metadata is collected. the files are concatenated in the given order unless they are
+# ordered automatically by their start and end points, see gpx2pln_chain.py.
 class GpxConcat:
-    def __init__(self, gpx_files):
+    def __init__(self, gpx_files, track=None, auto_order=False):
         # to be filled now...
         self.__authorName = set() # will be converted to a string later
         self.__authorLinks = set() # all links associated with the author
         self.__trackName = None # we will use the first one
         self.__trackLinks = set() # all links associated with the track in general
-        self.__trackCoords = list()
+        self.__track = None
         self.__maxElevation = None # maximum elevation in feet. none if unknown.
-
-        # reverse individual tracks if necessary to get one continuous track
-        if len(gpx_files) > 1:
-            # reverse the first track if necessary
-            start_dist = gpx_files[0].get_track_coords()[0].distance(gpx_files[1].get_track_coords()[0])
-            end_dist = gpx_files[0].get_track_coords()[-1].distance(gpx_files[1].get_track_coords()[0])
-            if start_dist < end_dist:
-                gpx_files[0].reverse()
-            
-            # reverse all the others if necessary
-            for i in range(1, len(gpx_files)):
-                start_dist = gpx_files[i].get_track_coords()[0].distance(gpx_files[i-1].get_track_coords()[-1])
-                end_dist = gpx_files[i].get_track_coords()[-1].distance(gpx_files[i-1].get_track_coords()[-1])
-                if end_dist < start_dist:
+        self.__order = list(range(len(gpx_files))) # positions of the concatenated gpx files in the given ones
+        self.__reversals = None # which of the concatenated gpx files were reversed. none if the track was given.
+
+        # order and reverse individual tracks if necessary to get one continuous track
+        assert track is None or not auto_order
+        if auto_order:
+            import gpx2pln_chain
+            self.__order, self.__reversals = gpx2pln_chain.chain_tracks([x.get_track_coords() for x in gpx_files])
+            gpx_files = [gpx_files[i] for i in self.__order]
+        elif track is None:
+            self.__reversals = choose_reversals([x.get_track_coords() for x in gpx_files])
+        if track is None:
+            for i in range(len(gpx_files)):
+                if self.__reversals[i]:
                     gpx_files[i].reverse()
 
         # collect the values
+        tracks = list()
         for gpx in gpx_files:
             self.__authorName.add(gpx.get_author_name())
             self.__authorLinks.update(gpx.get_author_links())
             if self.__trackName is None:
                 self.__trackName = gpx.get_track_name()
             self.__trackLinks.update(gpx.get_track_links())
-            self.__trackCoords.extend(gpx.get_track_coords())
+            if track is None:
+                tracks.append(gpx.get_track_coords())
             max_ele = gpx.get_max_elevation()
             if not max_ele is None:
                 if self.__maxElevation is None:
                     self.__maxElevation = 0.0
                 self.__maxElevation = max(self.__maxElevation, max_ele)
         
-        # convert the author names
-        self.__authorName = ", ".join(self.__authorName)
+        # one contiguous track
+        self.__track = gpx2pln_track.concatenate(tracks) if track is None else track
+
+        # convert the author names. sorted, so that every run writes the same.
+        self.__authorName = ", ".join(sorted(self.__authorName))
     
     def __len__(self):
-        return len(self.__trackCoords)
+        return len(self.__track)
     
     def get_author_name(self):
         return self.__authorName
@@ -309,10 +400,16 @@ class GpxConcat:
         return self.__trackLinks
     
     def get_track_coords(self):
-        return self.__trackCoords
+        return self.__track
     
     def get_max_elevation(self):
         return self.__maxElevation
     
+    def get_order(self):
+        return self.__order
+    
+    def get_reversals(self):
+        return self.__reversals
+    
     def reverse(self):
-        self.__trackCoords.reverse()
+        self.__track.reverse()
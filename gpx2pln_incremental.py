@@ -0,0 +1,98 @@
+import json
+import os
+
+# state of the last conversion of a route for converting it again incrementally. when only some of the gpx files
+# changed since then, only the legs that overlap them are planned again and only the pln files that changed are
+# written. the state is one json file next to the pln files with
+#   - the settings of the route and the metadata that goes into every pln file,
+#   - the content key, the number of points, the orientation and the position in the concatenated track of every
+#     gpx file,
+#   - the first and the last point in the concatenated track and the chosen waypoints of every leg.
+# the parsed tracks are found again in the cache of parsed gpx files by their content keys.
+
+STATE_VERSION = 2 # increase whenever the content of the state changes
+STATE_SETTINGS = ["max_leg_length", "num_leg_points", "algorithm", "tolerance", "reverse", "auto_order"]
+
+def state_fname(pln_stem):
+    return pln_stem + ".state.json"
+
+# the state written by write_state(). none if there is none or it is not usable.
+def read_state(fname):
+    try:
+        with open(fname, "r") as fd:
+            state = json.load(fd)
+    except (OSError, ValueError):
+        return None
+    if type(state) != dict or state.get("version") != STATE_VERSION:
+        return None
+    return state
+
+def write_state(fname, header, files, legs):
+    # write to a temporary file first, a broken state would skip legs that are not written yet
+    state = {"version": STATE_VERSION, "header": header, "files": files, "legs": legs}
+    tmp_fname = fname + ".tmp"
+    with open(tmp_fname, "w") as fd:
+        json.dump(state, fd)
+    os.replace(tmp_fname, fname)
+
+# everything that changes all legs when it changes
+def make_header(route, gpx):
+    header = {x: route[x] for x in STATE_SETTINGS}
+    header["track_name"] = gpx.get_track_name()
+    header["author_name"] = gpx.get_author_name()
+    header["max_elevation"] = gpx.get_max_elevation()
+    return header
+
+# the gpx files of a route in the order of concatenation with their position in the concatenated track, which is reversed as a whole if
+# the route is reversed
+def make_files(names, gpx_files, reversals, reverse):
+    starts = [0] * len(gpx_files)
+    start = 0
+    for i in (range(len(gpx_files))[::-1] if reverse else range(len(gpx_files))):
+        starts[i] = start
+        start += len(gpx_files[i])
+    return [{"name": os.path.abspath(names[i]), "key": gpx_files[i].get_content_key(), "num_points": len(gpx_files[i]), "start": starts[i], "reversed": reversals[i]} for i in range(len(gpx_files))]
+
+# the legs to convert now, given by the first and the last point in the concatenated track. legs that are kept have
+# their waypoints and their number in the last conversion, the other entries are ranges that have to be planned
+# again and may result in several legs. without a usable state the whole track is planned again.
+def plan_legs(state, header, files, num_points):
+    everything = [{"start": 0, "end": num_points - 1, "waypoints": None, "counter": None}]
+    if state is None or len(state["legs"]) == 0 or state["header"] != header or [x["name"] for x in state["files"]] != [x["name"] for x in files]:
+        return everything
+
+    # files whose points changed. the points of all others only moved along the track.
+    changed = [old["key"] != new["key"] or old["reversed"] != new["reversed"] for old, new in zip(state["files"], files)]
+    old_num_points = sum(x["num_points"] for x in state["files"])
+    def map_point(idx):
+        if idx == 0:
+            return 0
+        if idx == old_num_points - 1:
+            return num_points - 1
+        for old, new, is_changed in zip(state["files"], files, changed):
+            if not is_changed and old["start"] <= idx < old["start"] + old["num_points"]:
+                return idx - old["start"] + new["start"]
+        return None
+
+    # legs that overlap changed files are planned again, neighbouring ones as one range
+    plan = list()
+    for i, leg in enumerate(state["legs"]):
+        start = map_point(leg["start"])
+        end = map_point(leg["end"])
+        overlaps = any(changed[j] and leg["start"] < x["start"] + x["num_points"] and x["start"] <= leg["end"] for j, x in enumerate(state["files"]))
+        if not overlaps and not start is None and not end is None:
+            plan.append({"start": start, "end": end, "waypoints": leg["waypoints"], "counter": i + 1})
+        elif len(plan) > 0 and plan[-1]["waypoints"] is None:
+            plan[-1]["end"] = end
+        else:
+            plan.append({"start": start, "end": end, "waypoints": None, "counter": None})
+
+    # the legs have to cover the new track without gaps, otherwise everything is planned again
+    if plan[0]["start"] != 0 or plan[-1]["end"] != num_points - 1:
+        return everything
+    for i in range(len(plan)):
+        if plan[i]["start"] is None or plan[i]["end"] is None or plan[i]["end"] <= plan[i]["start"]:
+            return everything
+        if i > 0 and plan[i-1]["end"] != plan[i]["start"]:
+            return everything
+    return plan
@@ -0,0 +1,99 @@
+import numpy as np
+import gpx2pln_geo
+
+LEG_BATCH_SIZE = 4096 # kept points that are measured at once when splitting while the points are produced
+
+# split a track into legs of a maximum length. the track is given by the distance along the track for every point
+# as returned by gpx2pln_geo.cumulative_distance(). a leg is cut at the point whose distance from the start of the
+# leg is closest to the maximum length, which may be slightly above it. the result are index ranges with inclusive
+# ends, consecutive legs share the point where they were cut.
+def leg_ranges(cum_dist, max_leg_length):
+    num_points = len(cum_dist)
+    assert num_points > 1
+
+    # no splitting requested?
+    if max_leg_length is None:
+        return np.array([[0, num_points - 1]], dtype=np.intp)
+
+    # find the cuts
+    ranges = list()
+    start = 0
+    while start < num_points - 1:
+        # first point that is too far away
+        end = int(np.searchsorted(cum_dist, cum_dist[start] + max_leg_length, side="right"))
+        if end >= num_points:
+            ranges.append((start, num_points - 1))
+            break
+
+        # cut at the point closer to the maximum length. never create legs with a single point.
+        over = cum_dist[end] - cum_dist[start] - max_leg_length
+        under = max_leg_length - (cum_dist[end-1] - cum_dist[start])
+        if over >= under and end - 1 > start:
+            end -= 1
+        ranges.append((start, end))
+        start = end
+
+    # finished
+    return np.array(ranges, dtype=np.intp)
+
+# same as leg_ranges() while the points of the track are still produced, e.g. by simplifying a memory-mapped track.
+# the points are given as blocks of indices into lats and lons in increasing order. yields the indices of the points
+# of every leg as soon as the leg is complete, only the current leg is kept in memory.
+def iter_leg_indices(lats, lons, index_blocks, max_leg_length):
+    pending = list() # indices of the current leg, starting with its first point
+    num_points = 0 # points seen so far
+    leg_start = 0 # position of the first point of the current leg
+    leg_start_dist = 0.0
+    last_dist = None # distance along the track of the last point seen so far
+    for block in _batches(index_blocks):
+        # distances along the track continue from the last point of the previous block
+        block_lats = lats[block]
+        block_lons = lons[block]
+        if last_dist is None:
+            cum_dist = np.zeros(len(block), dtype=np.float64)
+            np.cumsum(gpx2pln_geo.segment_distances(block_lats, block_lons), out=cum_dist[1:])
+            block_start = num_points
+        else:
+            prev = pending[-1][-1:]
+            cum_dist = np.cumsum(np.concatenate(([last_dist], gpx2pln_geo.segment_distances(np.concatenate((lats[prev], block_lats)), np.concatenate((lons[prev], block_lons))))))
+            block_start = num_points - 1
+        pending.append(block)
+        num_points += len(block)
+        last_dist = float(cum_dist[-1])
+
+        # cut every leg that ends within this block like leg_ranges() does
+        while not max_leg_length is None:
+            end = int(np.searchsorted(cum_dist, leg_start_dist + max_leg_length, side="right"))
+            if end >= len(cum_dist):
+                break
+            over = cum_dist[end] - leg_start_dist - max_leg_length
+            under = max_leg_length - (cum_dist[end-1] - leg_start_dist)
+            if over >= under and block_start + end - 1 > leg_start:
+                end -= 1
+            leg_end = block_start + end
+
+            # hand out the leg and keep its last point as the first of the next leg
+            indices = np.concatenate(pending)
+            yield indices[:leg_end-leg_start+1]
+            pending = [indices[leg_end-leg_start:]]
+            leg_start = leg_end
+            leg_start_dist = float(cum_dist[end])
+
+    # the rest of the track is the last leg
+    assert num_points > 1
+    if leg_start < num_points - 1:
+        yield np.concatenate(pending)
+
+# collect small blocks of indices to measure them at once
+def _batches(index_blocks):
+    batch = list()
+    batch_size = 0
+    for block in index_blocks:
+        batch.append(block)
+        batch_size += len(block)
+        if batch_size >= LEG_BATCH_SIZE:
+            yield np.concatenate(batch)
+            batch = list()
+            batch_size = 0
+    if batch_size > 0:
+        yield np.concatenate(batch)
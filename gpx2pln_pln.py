@@ -1,6 +1,7 @@
-import xml.etree.ElementTree
-import LatLon23
-import copy
+import numpy as np
+import gpx2pln_geo
+import gpx2pln_profile
+from gpx2pln_track import Track
 
 # DISCLAIMER: I didn't really study the PLN file format. I've exported from Microsoft Flight Simulator 2020 and did 'learning by doing'.
 #             Feel free to improve this! :-) I just kindly request that the export is compatible with Microsoft Flight Simulator 2020.
@@ -8,14 +9,70 @@ import copy
 # add a slight offset to the last waypoint when ending in flight just to see two different points on the map
 DEGREE_OFFSET_END_IN_FLIGHT = 0.1 # in degree
 
-# format geo-coordinates and elevation for the .pln format
-def _coord2str(coord, elevation):
-    assert type(coord) == LatLon23.LatLon
+# the document is written as one line without indentation, exactly like elementtree did it before
+PLN_DOCUMENT_HEADER = "<?xml version='1.0' encoding='utf-8'?>\n<SimBase.Document Type=\"AceXML\" version=\"1,0\"><Descr>AceXML Document</Descr><FlightPlan.FlightPlan>"
+PLN_DOCUMENT_FOOTER = "</FlightPlan.FlightPlan></SimBase.Document>"
+PLN_APP_VERSION = "<AppVersion><AppVersionMajor>11</AppVersionMajor><AppVersionBuild>282174</AppVersionBuild></AppVersion>"
+PLN_USER_WAYPOINT = "<ATCWaypoint id=\"Cust%i\"><ATCWaypointType>User</ATCWaypointType><WorldPosition>%s</WorldPosition><SpeedMaxFP>-1</SpeedMaxFP></ATCWaypoint>"
+PLN_WRITE_BUFFER_SIZE = 1024 * 1024 # in bytes
+PLN_NUM_FIXED_NODES = 28 # xml nodes of the document, the flight plan and the two airports
+
+# escape text and attribute values like elementtree
+def _escape_text(text):
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+def _escape_attribute(text):
+    text = _escape_text(text).replace("\"", "&quot;")
+    return text.replace("\r", "&#13;").replace("\n", "&#10;").replace("\t", "&#09;")
+
+# element with text. empty elements are closed right away like elementtree does.
+def _element(tag, text):
+    if len(text) == 0:
+        return "<%s />" % tag
+    return "<%s>%s</%s>" % (tag, _escape_text(text), tag)
+
+# degree, minute and second with the sign of the value. same arithmetic as latlon23 to get the same digits.
+def _degree_minute_second(values):
+    signs = np.sign(values)
+    values = np.abs(values)
+    degrees = values // 1
+    decimal_minutes = (values - degrees) * 60.0
+    minutes = decimal_minutes // 1
+    seconds = (decimal_minutes - minutes) * 60.0
+    return degrees * signs, minutes * signs, seconds * signs
+
+# geo-coordinates the way latlon23 keeps them: latitudes as given, longitudes wrapped to [-180, 180) and
+# recomputed from degree, minute and second
+def _normalize(lats, lons):
+    lats = np.asarray(lats, dtype=np.float64) + 0.0 / 60.0 + 0.0 / 3600.0
+    lons = np.asarray(lons, dtype=np.float64) + 0.0 / 60.0 + 0.0 / 3600.0
+    degrees, minutes, seconds = _degree_minute_second(((lons + 180.0) % 360.0) - 180.0)
+    return lats, degrees + minutes / 60.0 + seconds / 3600.0
+
+# format many geo-coordinates and one elevation for the .pln format. the coordinates have to be normalized.
+# the strings never contain characters that need escaping.
+def _coords2str(lats, lons, elevation):
     assert type(elevation) == int
-    coord = coord.to_string("%H%d%° %m%' %S%\"")
-    coord = ",".join(coord)
-    elevation = str(float(elevation))
-    return coord + ",+" + elevation
+    elevation = ",+" + str(float(elevation))
+    strings = list()
+    for hemispheres, values in ((("N", "S"), lats), (("E", "W"), lons)):
+        degrees, minutes, seconds = _degree_minute_second(values)
+        strings.append(["%s%i° %i' %s\"" % (hemispheres[value < 0.0], degree, abs(minute), abs(second)) for value, degree, minute, second in zip(values.tolist(), degrees.tolist(), minutes.tolist(), seconds.tolist())])
+    return [(lat + "," + lon).replace("-", "") + elevation for lat, lon in zip(strings[0], strings[1])]
+
+# format one geo-coordinate and elevation for the .pln format
+def _coord2str(lat, lon, elevation):
+    lats, lons = _normalize([lat], [lon])
+    return _coords2str(lats, lons, elevation)[0]
+
+# write the parts of a document prepared by PlnFile.write()
+def _write_document(fd, parts, airports, waypoint_coords):
+    fd.write("".join(parts))
+    fd.write(airports[0])
+    for i in range(len(waypoint_coords)):
+        fd.write(PLN_USER_WAYPOINT % (i+1, waypoint_coords[i]))
+    fd.write(airports[1])
+    fd.write(PLN_DOCUMENT_FOOTER)
 
 # representation of a .pln file
 class PlnFile:
@@ -29,11 +86,8 @@ class PlnFile:
         assert type(self.__flightDescription) == str and len(self.__flightDescription) > 0
         
         # save the coordinates
-        assert type(coords) == list and len(coords) > 1
-        self.__flightCoords = list()
-        for val in coords:
-            assert type(val) == LatLon23.LatLon
-            self.__flightCoords.append(val)
+        assert type(coords) == Track and len(coords) > 1
+        self.__flightCoords = coords
         
         # save the elevation
         self.__flightElevation = 10000 # default flight elevation
@@ -42,12 +96,12 @@ class PlnFile:
             self.__flightElevation = max(self.__flightElevation, int(elevation) + 3500)
         assert type(self.__flightElevation) == int and self.__flightElevation > 0
 
-    def write(self, fname, airport_db):
-        # sanity checks
-        assert not airport_db is None
+    def write(self, fname, airport_db, departure_airport=None, destination_airport=None):
+        # sanity checks. the airports can be looked up beforehand for many flight plans at once.
+        assert not airport_db is None or (not departure_airport is None and not destination_airport is None)
 
-        # select waypoints to write
-        coords = copy.deepcopy(self.__flightCoords)
+        # waypoints to write as normalized arrays, i.e. exactly the values written to the file
+        lats, lons = _normalize(self.__flightCoords.get_lats(), self.__flightCoords.get_lons())
 
         # HINT: microsoft flight simulator seems to loose the last waypoint when finishing in the air.
         # this is why we add the last waypoint twice when not using the airport database.
@@ -56,94 +110,79 @@ class PlnFile:
         # this looks strange on the world map when planning a flight, but the vfr map seems to be okay.
 
         # nearest departure airport
-        lat = float(coords[0].lat)
-        lon = float(coords[0].lon)
-        departure_id, departure_lat, departure_lon, departure_ele, departure_name = airport_db.find_nearest(lat, lon)
+        if departure_airport is None:
+            departure_airport = airport_db.find_nearest(float(lats[0]), float(lons[0]))
+        departure_id, departure_lat, departure_lon, departure_ele, departure_name = departure_airport
         departure_type = "Airport"
-        departure_coord = _coord2str(LatLon23.LatLon(departure_lat, departure_lon), departure_ele)
+        departure_coord = _coord2str(departure_lat, departure_lon, departure_ele)
 
         # nearest destination airport
-        lat = float(coords[-1].lat)
-        lon = float(coords[-1].lon)
-        destination_id, destination_lat, destination_lon, destination_ele, destination_name = airport_db.find_nearest(lat, lon)
+        if destination_airport is None:
+            destination_airport = airport_db.find_nearest(float(lats[-1]), float(lons[-1]))
+        destination_id, destination_lat, destination_lon, destination_ele, destination_name = destination_airport
         destination_type = "Airport"
-        destination_coord = _coord2str(LatLon23.LatLon(destination_lat, destination_lon), destination_ele)
+        destination_coord = _coord2str(destination_lat, destination_lon, destination_ele)
 
         # are the two airports the same?
         if departure_id == destination_id:
             # distances to the departure and destination
-            departure_dist = coords[0].distance(LatLon23.LatLon(departure_lat, departure_lon))
-            destination_dist = coords[-1].distance(LatLon23.LatLon(destination_lat, destination_lon))
+            departure_dist = gpx2pln_geo.distance(float(lats[0]), float(lons[0]), departure_lat, departure_lon)
+            destination_dist = gpx2pln_geo.distance(float(lats[-1]), float(lons[-1]), destination_lat, destination_lon)
             
             # use the airport to the nearest waypoint
             if departure_dist < destination_dist:
                 # destination info
                 destination_id = "CUSTA"
                 destination_type = "Intersection"
-                lat = float(coords[-1].lat) + DEGREE_OFFSET_END_IN_FLIGHT
-                lon = float(coords[-1].lon) + DEGREE_OFFSET_END_IN_FLIGHT
-                destination_coord = _coord2str(LatLon23.LatLon(lat, lon), self.__flightElevation)
+                lat = float(lats[-1]) + DEGREE_OFFSET_END_IN_FLIGHT
+                lon = float(lons[-1]) + DEGREE_OFFSET_END_IN_FLIGHT
+                destination_coord = _coord2str(lat, lon, self.__flightElevation)
                 destination_name = "GPX destination"
             else:
                 # departure info
                 departure_id = "CUSTD"
                 departure_type = "Intersection"
-                departure_coord = _coord2str(coords[0], self.__flightElevation)
+                departure_coord = _coord2str(float(lats[0]), float(lons[0]), self.__flightElevation)
                 departure_name = "GPX departure"
 
                 # trim the coordinates
-                coords = coords[1:]
-
-        # empty xml document
-        xml_root = xml.etree.ElementTree.Element("SimBase.Document", {"Type": "AceXML", "version": "1,0"})
-        xml_data = xml.etree.ElementTree.ElementTree(xml_root)
-
-        # general information
-        xml.etree.ElementTree.SubElement(xml_root, "Descr").text = "AceXML Document"
-
-        # flight plan
-        flightplan_node = xml.etree.ElementTree.SubElement(xml_root, "FlightPlan.FlightPlan")
-        xml.etree.ElementTree.SubElement(flightplan_node, "Title").text = self.__flightTitle
-        xml.etree.ElementTree.SubElement(flightplan_node, "FPType").text = "VFR"
-        xml.etree.ElementTree.SubElement(flightplan_node, "CruisingAlt").text = str(self.__flightElevation)
-        xml.etree.ElementTree.SubElement(flightplan_node, "DepartureID").text = departure_id
-        xml.etree.ElementTree.SubElement(flightplan_node, "DepartureLLA").text = departure_coord
-        xml.etree.ElementTree.SubElement(flightplan_node, "DestinationID").text = destination_id
-        xml.etree.ElementTree.SubElement(flightplan_node, "DestinationLLA").text = destination_coord
-        xml.etree.ElementTree.SubElement(flightplan_node, "Descr").text = self.__flightDescription
-        xml.etree.ElementTree.SubElement(flightplan_node, "DepartureName").text = departure_name
-        xml.etree.ElementTree.SubElement(flightplan_node, "DestinationName").text = destination_name
-
-        # app version
-        app_version_node = xml.etree.ElementTree.SubElement(flightplan_node, "AppVersion")
-        xml.etree.ElementTree.SubElement(app_version_node, "AppVersionMajor").text = "11"
-        xml.etree.ElementTree.SubElement(app_version_node, "AppVersionBuild").text = "282174"
-
-        # write the departure
-        departure_node = xml.etree.ElementTree.SubElement(flightplan_node, "ATCWaypoint", {"id": departure_id})
-        xml.etree.ElementTree.SubElement(departure_node, "ATCWaypointType").text = departure_type
-        xml.etree.ElementTree.SubElement(departure_node, "WorldPosition").text = departure_coord
-        xml.etree.ElementTree.SubElement(departure_node, "SpeedMaxFP").text = "-1"
-        icao_node = xml.etree.ElementTree.SubElement(departure_node, "ICAO")
-        xml.etree.ElementTree.SubElement(icao_node, "ICAOIdent").text = departure_id
-
-        # write the waypoints
-        for i in range(len(coords)):
-            coord = coords[i]
-            name = "Cust" + str(i+1)
-            type = "User"
-            waypoint_node = xml.etree.ElementTree.SubElement(flightplan_node, "ATCWaypoint", {"id": name})
-            xml.etree.ElementTree.SubElement(waypoint_node, "ATCWaypointType").text = type
-            xml.etree.ElementTree.SubElement(waypoint_node, "WorldPosition").text = _coord2str(coord, self.__flightElevation)
-            xml.etree.ElementTree.SubElement(waypoint_node, "SpeedMaxFP").text = "-1"
-        
-        # write the destination
-        destination_node = xml.etree.ElementTree.SubElement(flightplan_node, "ATCWaypoint", {"id": destination_id})
-        xml.etree.ElementTree.SubElement(destination_node, "ATCWaypointType").text = destination_type
-        xml.etree.ElementTree.SubElement(destination_node, "WorldPosition").text = destination_coord
-        xml.etree.ElementTree.SubElement(destination_node, "SpeedMaxFP").text = "-1"
-        icao_node = xml.etree.ElementTree.SubElement(destination_node, "ICAO")
-        xml.etree.ElementTree.SubElement(icao_node, "ICAOIdent").text = destination_id
-        
-        # write the xml document to the file
-        xml_data.write(fname, encoding="utf-8", xml_declaration=True)
+                lats = lats[1:]
+                lons = lons[1:]
+
+        # format all waypoints at once
+        waypoint_coords = _coords2str(lats, lons, self.__flightElevation)
+
+        # general information and flight plan
+        parts = [PLN_DOCUMENT_HEADER]
+        parts.append(_element("Title", self.__flightTitle))
+        parts.append(_element("FPType", "VFR"))
+        parts.append(_element("CruisingAlt", str(self.__flightElevation)))
+        parts.append(_element("DepartureID", departure_id))
+        parts.append(_element("DepartureLLA", departure_coord))
+        parts.append(_element("DestinationID", destination_id))
+        parts.append(_element("DestinationLLA", destination_coord))
+        parts.append(_element("Descr", self.__flightDescription))
+        parts.append(_element("DepartureName", departure_name))
+        parts.append(_element("DestinationName", destination_name))
+        parts.append(PLN_APP_VERSION)
+
+        # departure and destination
+        airports = list()
+        for airport_id, airport_type, airport_coord in ((departure_id, departure_type, departure_coord), (destination_id, destination_type, destination_coord)):
+            airports.append("".join([
+                "<ATCWaypoint id=\"%s\">" % _escape_attribute(airport_id),
+                _element("ATCWaypointType", airport_type),
+                _element("WorldPosition", airport_coord),
+                "<SpeedMaxFP>-1</SpeedMaxFP><ICAO>",
+                _element("ICAOIdent", airport_id),
+                "</ICAO></ATCWaypoint>"
+            ]))
+
+        # write the document. the waypoints are formatted straight into the buffered file, or into the given text
+        # file object, e.g. io.StringIO for keeping the document in memory.
+        if type(fname) == str:
+            with open(fname, "w", encoding="utf-8", errors="xmlcharrefreplace", buffering=PLN_WRITE_BUFFER_SIZE) as fd:
+                _write_document(fd, parts, airports, waypoint_coords)
+        else:
+            _write_document(fname, parts, airports, waypoint_coords)
+        gpx2pln_profile.count("xml_nodes_written", PLN_NUM_FIXED_NODES + 4 * len(waypoint_coords))
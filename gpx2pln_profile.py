@@ -0,0 +1,93 @@
+import contextlib
+import sys
+import time
+
+# measurements of the stages of a run. every stage records its wall and cpu time, the number of items it processed,
+# the peak memory of the process afterwards and the expensive operations counted meanwhile. cpu time and counters
+# only cover this process, the counters of pool workers have to be handed back and added explicitly.
+
+# counters of expensive operations in this process, e.g. geodesic distance evaluations
+_COUNTERS = dict()
+
+def count(name, num=1):
+    _COUNTERS[name] = _COUNTERS.get(name, 0) + int(num)
+
+def get_counters():
+    return dict(_COUNTERS)
+
+def add_counters(counters):
+    for name, num in counters.items():
+        count(name, num)
+
+# counters that changed since the given result of get_counters()
+def counters_since(snapshot):
+    return {name: num - snapshot.get(name, 0) for name, num in _COUNTERS.items() if num != snapshot.get(name, 0)}
+
+# peak resident memory of this process in bytes. none if unknown on this platform.
+def peak_rss():
+    try:
+        import resource
+    except ImportError:
+        resource = None
+    if not resource is None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024 # kilobytes everywhere but on macos
+    if sys.platform == "win32":
+        import ctypes
+        import ctypes.wintypes
+        class _ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [
+                ("cb", ctypes.wintypes.DWORD),
+                ("PageFaultCount", ctypes.wintypes.DWORD),
+                ("PeakWorkingSetSize", ctypes.c_size_t),
+                ("WorkingSetSize", ctypes.c_size_t),
+                ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                ("PagefileUsage", ctypes.c_size_t),
+                ("PeakPagefileUsage", ctypes.c_size_t)
+            ]
+        counters = _ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        if ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+            return int(counters.PeakWorkingSetSize)
+    return None
+
+class StageProfile:
+    def __init__(self):
+        self.__stages = list()
+
+    @contextlib.contextmanager
+    def stage(self, name, num_items=None):
+        # the caller can still set the number of items in the yielded record when it is only known afterwards
+        record = {"name": name, "num_items": num_items}
+        rss_before = peak_rss()
+        counters_before = get_counters()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        yield record
+        record["wall_seconds"] = time.perf_counter() - wall_start
+        record["cpu_seconds"] = time.process_time() - cpu_start
+        record["counters"] = counters_since(counters_before)
+
+        # throughput if the number of items is known
+        record["items_per_second"] = None
+        if not record["num_items"] is None and record["wall_seconds"] > 0.0:
+            record["items_per_second"] = record["num_items"] / record["wall_seconds"]
+
+        # the peak memory only grows, so the increase is the memory this stage needed beyond all earlier stages
+        record["peak_rss_bytes"] = peak_rss()
+        record["peak_rss_increase_bytes"] = None
+        if not rss_before is None:
+            record["peak_rss_increase_bytes"] = record["peak_rss_bytes"] - rss_before
+        self.__stages.append(record)
+
+    def get_stages(self):
+        return self.__stages
+
+    def get_stage(self, name):
+        for record in self.__stages:
+            if record["name"] == name:
+                return record
+        return None
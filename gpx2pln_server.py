@@ -0,0 +1,245 @@
+import argparse
+import asyncio
+import io
+import os
+import time
+import urllib.parse
+import gpx2pln_convert
+
+# long-running local conversion service. the airports database, the worker pool and the cache of parsed gpx files
+# are loaded once, so a conversion only pays for the actual work. the api is plain http on a local port or a unix
+# socket:
+#   POST /convert?pln_stem=...&max_leg_length=...  with one gpx file or a zip of gpx files as body. answers with a
+#                                                  zip of the pln files and, with plot=1, the plot.
+#   GET /status                                    answers with the number of airports and conversions so far.
+# the parameters are the same as for the command line tool. zipped gpx files are used in the order of their names
+# unless they are ordered automatically.
+
+DEFAULT_HOST = "127.0.0.1" # local only, there is no authentication
+DEFAULT_PORT = 8152
+DEFAULT_MAX_CONCURRENT = 4 # conversions running at the same time
+MAX_UPLOAD_SIZE = 256 * 1024 * 1024 # in bytes
+MAX_HEADER_LINES = 100
+HTTP_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 411: "Length Required", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+class _HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def _parse_bool(value):
+    if value.lower() in ("1", "true", "yes", "on"):
+        return True
+    if value.lower() in ("0", "false", "no", "off"):
+        return False
+    raise ValueError("not a boolean: %s" % value)
+
+# types of the parameters of a conversion. the plot parameters are not part of the route.
+ROUTE_PARAMETERS = {
+    "pln_stem": str,
+    "max_leg_length": int,
+    "num_leg_points": int,
+    "algorithm": str,
+    "tolerance": float,
+    "smooth": _parse_bool,
+    "reverse": _parse_bool,
+    "auto_order": _parse_bool
+}
+PLOT_PARAMETERS = {
+    "plot": _parse_bool,
+    "raster_plot": _parse_bool
+}
+
+# gpx files of an upload in order
+def _uploaded_gpx_files(body):
+    import zipfile
+    if not body.startswith(b"PK"):
+        return [body]
+    try:
+        with zipfile.ZipFile(io.BytesIO(body)) as archive:
+            names = sorted(x for x in archive.namelist() if x.lower().endswith(".gpx"))
+            return [archive.read(x) for x in names]
+    except zipfile.BadZipFile:
+        raise _HttpError(400, "The upload is neither a GPX file nor a valid zip file.")
+
+# zip with all files of the results in memory
+def _zip_results(results):
+    import zipfile
+    fd = io.BytesIO()
+    with zipfile.ZipFile(fd, "w", zipfile.ZIP_DEFLATED) as archive:
+        for result in results:
+            for name, data in result["files"].items():
+                archive.writestr(name, data)
+    return fd.getvalue()
+
+class ConversionServer:
+    def __init__(self, converter, max_concurrent=DEFAULT_MAX_CONCURRENT):
+        import concurrent.futures
+        import threading
+        self.__converter = converter
+        self.__executor = concurrent.futures.ThreadPoolExecutor(max_concurrent)
+        self.__numConversions = 0
+        self.__lock = threading.Lock() # the conversions are counted from the threads of the executor
+
+    def close(self):
+        self.__executor.shutdown()
+
+    # convert one upload. runs in a thread of the executor, the heavy work is done in the pool of the converter.
+    def __convert(self, body, query):
+        # parameters of the conversion
+        route_settings = {"pln_stem": "route"}
+        plot_settings = {"plot": False, "raster_plot": False}
+        for name, values in urllib.parse.parse_qs(query, keep_blank_values=True).items():
+            if name in ROUTE_PARAMETERS:
+                settings, parse = route_settings, ROUTE_PARAMETERS[name]
+            elif name in PLOT_PARAMETERS:
+                settings, parse = plot_settings, PLOT_PARAMETERS[name]
+            else:
+                raise _HttpError(400, "Unknown parameter '%s'." % name)
+            try:
+                settings[name] = parse(values[-1])
+            except ValueError:
+                raise _HttpError(400, "Invalid value for parameter '%s'." % name)
+
+        # the pln stem names files in the zip, not on the disk
+        route_settings["pln_stem"] = os.path.basename(route_settings["pln_stem"])
+        gpx_files = _uploaded_gpx_files(body)
+        if len(gpx_files) == 0:
+            raise _HttpError(400, "No GPX files uploaded.")
+        try:
+            route = gpx2pln_convert.make_route(gpx_files, **route_settings)
+        except ValueError as error:
+            raise _HttpError(400, "Invalid parameters: %s" % error)
+
+        # convert in memory
+        import xml.etree.ElementTree
+        try:
+            results = self.__converter.convert([route], plot_settings["plot"], plot_settings["raster_plot"], in_memory=True)
+        except xml.etree.ElementTree.ParseError as error:
+            raise _HttpError(400, "Invalid GPX file: %s" % error)
+        except gpx2pln_convert.EmptyRouteError as error:
+            raise _HttpError(400, str(error))
+        with self.__lock:
+            self.__numConversions += 1
+        return _zip_results(results)
+
+    async def __read_request(self, reader):
+        # request line and headers
+        request_line = (await reader.readline()).decode("latin-1").split()
+        if len(request_line) != 3:
+            raise _HttpError(400, "Malformed request.")
+        method, target, _ = request_line
+        headers = dict()
+        for _ in range(MAX_HEADER_LINES):
+            line = (await reader.readline()).decode("latin-1")
+            if line in ("\r\n", "\n", ""):
+                break
+            if not ":" in line:
+                raise _HttpError(400, "Malformed header.")
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+        else:
+            raise _HttpError(400, "Too many headers.")
+
+        # body
+        body = b""
+        if method == "POST":
+            if not "content-length" in headers:
+                raise _HttpError(411, "Content-Length is required.")
+            try:
+                length = int(headers["content-length"])
+            except ValueError:
+                raise _HttpError(400, "Invalid Content-Length.")
+            if length < 0 or length > MAX_UPLOAD_SIZE:
+                raise _HttpError(413, "Uploads are limited to %i bytes." % MAX_UPLOAD_SIZE)
+            body = await reader.readexactly(length)
+        return method, target, body
+
+    async def __respond(self, writer, status, content_type, body):
+        header = "HTTP/1.1 %i %s\r\nContent-Type: %s\r\nContent-Length: %i\r\nConnection: close\r\n\r\n" % (status, HTTP_REASONS[status], content_type, len(body))
+        writer.write(header.encode("latin-1") + body)
+        await writer.drain()
+
+    async def __handle(self, reader, writer):
+        start = time.perf_counter()
+        target = None
+        try:
+            try:
+                method, target, body = await self.__read_request(reader)
+                path, _, query = target.partition("?")
+                if path == "/convert":
+                    if method != "POST":
+                        raise _HttpError(405, "Use POST for conversions.")
+                    loop = asyncio.get_running_loop()
+                    data = await loop.run_in_executor(self.__executor, self.__convert, body, query)
+                    status, content_type = 200, "application/zip"
+                elif path == "/status":
+                    status, content_type = 200, "application/json"
+                    data = ("{\"num_airports\": %i, \"num_conversions\": %i}" % (len(self.__converter.get_airport_db()), self.__numConversions)).encode("utf-8")
+                else:
+                    raise _HttpError(404, "Unknown path.")
+            except _HttpError as error:
+                status, content_type, data = error.status, "text/plain", str(error).encode("utf-8")
+            except asyncio.IncompleteReadError:
+                return
+            except Exception as error:
+                status, content_type, data = 500, "text/plain", ("%s: %s" % (type(error).__name__, error)).encode("utf-8")
+            await self.__respond(writer, status, content_type, data)
+            print("%s -> %i in %.3f s" % (target, status, time.perf_counter() - start), flush=True)
+        finally:
+            writer.close()
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT, unix_socket=None):
+        if unix_socket is None:
+            server = await asyncio.start_server(self.__handle, host, port)
+            print("Listening on http://%s:%i/ ..." % (host, port), flush=True)
+        else:
+            server = await asyncio.start_unix_server(self.__handle, unix_socket)
+            print("Listening on %s ..." % unix_socket, flush=True)
+        async with server:
+            await server.serve_forever()
+
+def main():
+    # parse command line arguments
+    parser = argparse.ArgumentParser(description="Serve GPX to PLN conversions over local HTTP with the airports database kept in memory.")
+    parser.add_argument("--host", type=str, default=DEFAULT_HOST, help="Address to listen on.")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Port to listen on.")
+    parser.add_argument("--unix_socket", type=str, default=None, help="Path to a unix socket to listen on instead of a port.")
+    parser.add_argument("--jobs", type=int, default=None, help="Number of processes for reading GPX files and writing PLN files. Defaults to the number of CPUs.")
+    parser.add_argument("--max_concurrent", type=int, default=DEFAULT_MAX_CONCURRENT, help="Maximum number of conversions running at the same time.")
+    parser.add_argument("--no_cache", action="store_true", help="Do not use the cache of parsed GPX files.")
+    parser.add_argument("--airport_sources", type=str, default=None, help="Local directory or URL of a mirror with the airports.json of mwgg and the airports.csv of ourairports.com for building the airports database. Defaults to downloading them.")
+    args = parser.parse_args()
+    if args.max_concurrent < 1:
+        parser.error("--max_concurrent has to be positive")
+    if not args.jobs is None and args.jobs < 1:
+        parser.error("--jobs has to be positive")
+
+    # import the pipeline before starting the worker pool, so that the workers start with everything loaded
+    import scipy.spatial
+    import gpx2pln_gpx
+    import gpx2pln_pln
+    import gpx2pln_subsample
+    import gpx2pln_douglas_peucker
+    import gpx2pln_visvalingam
+
+    # paths like for the command line tool
+    airports_json = os.environ["APPDATA"] + "\\gpx2pln_airports.json"
+    cache_dir = None
+    if not args.no_cache:
+        cache_dir = os.environ["APPDATA"] + "\\gpx2pln_cache"
+
+    # load everything once and serve until interrupted
+    converter = gpx2pln_convert.Converter(airports_json, args.jobs, cache_dir, airport_sources=args.airport_sources)
+    server = ConversionServer(converter, args.max_concurrent)
+    try:
+        converter.get_airport_db()
+        asyncio.run(server.serve(args.host, args.port, args.unix_socket))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        converter.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+import heapq
+import math
+import numpy as np
+import gpx2pln_geo
+import gpx2pln_profile
+import gpx2pln_spatial
+
+# simplification of tracks given as float64 arrays. points are mapped to earth-centred cartesian coordinates in
+# kilometers, which is a metric frame everywhere along the track. straight distances in this frame are the chords
+# of the geodesic distances and practically identical to them for the tolerances used here.
+
+# cartesian coordinates in kilometers
+def to_metric(lats, lons):
+    return gpx2pln_spatial.to_xyz(lats, lons) * gpx2pln_geo.EARTH_RADIUS
+
+# distances between the points and the segment from a to b
+def _distances_to_segment(points, a, b):
+    ab = b - a
+    ab_len2 = np.dot(ab, ab)
+    if ab_len2 == 0.0:
+        return np.linalg.norm(points - a, axis=1)
+    t = np.clip(np.dot(points - a, ab) / ab_len2, 0.0, 1.0)
+    return np.linalg.norm(points - (a + t[:,None] * ab), axis=1)
+
+# indices of the points kept by the douglas-peucker algorithm. tolerance is the maximum distance in kilometers
+# between the original and the simplified track. the first and the last point are always kept.
+def douglas_peucker_indices(lats, lons, tolerance):
+    num_points = len(lats)
+    if num_points < 3:
+        return np.arange(num_points)
+    return _douglas_peucker_indices(to_metric(lats, lons), tolerance)
+
+def _douglas_peucker_indices(points, tolerance):
+    num_points = len(points)
+
+    # iterate over the open ranges with an explicit stack instead of recursion
+    keep = np.zeros(num_points, dtype=bool)
+    keep[0] = True
+    keep[-1] = True
+    stack = [(0, num_points - 1)]
+    num_checks = 0
+    while len(stack) > 0:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        num_checks += end - start - 1
+
+        # farthest point between start and end
+        dists = _distances_to_segment(points[start+1:end], points[start], points[end])
+        max_idx = int(np.argmax(dists))
+
+        # split there if it is too far away
+        if dists[max_idx] > tolerance:
+            split = start + 1 + max_idx
+            keep[split] = True
+            stack.append((split, end))
+            stack.append((start, split))
+
+    # finished
+    gpx2pln_profile.count("douglas_peucker_point_checks", num_checks)
+    return np.flatnonzero(keep)
+
+# same as douglas_peucker_indices(), but yields the kept indices in blocks in increasing order while the track is
+# simplified from its start to its end. ranges of up to chunk_size points are simplified at once, larger ones are
+# searched for their farthest point chunk by chunk. the cartesian coordinates are computed once for tracks in memory
+# and chunk by chunk for tracks that do not fit into memory, e.g. memory-mapped ones.
+def iter_douglas_peucker_indices(lats, lons, tolerance, chunk_size, in_memory=True):
+    num_points = len(lats)
+    if num_points < 3:
+        yield np.arange(num_points)
+        return
+    yield np.zeros(1, dtype=np.intp)
+    all_points = to_metric(lats, lons) if in_memory else None
+    def points(start, end):
+        if all_points is None:
+            return to_metric(lats[start:end], lons[start:end])
+        return all_points[start:end]
+
+    # the left part of a split is finished first, so the end of every finished range is the next kept point
+    stack = [(0, num_points - 1)]
+    num_checks = 0
+    while len(stack) > 0:
+        start, end = stack.pop()
+        if end - start < chunk_size:
+            yield _douglas_peucker_indices(points(start, end + 1), tolerance)[1:] + start
+            continue
+        num_checks += end - start - 1
+
+        # farthest point between start and end. the first one wins ties like np.argmax() does.
+        a = points(start, start + 1)[0]
+        b = points(end, end + 1)[0]
+        max_dist = -np.inf
+        split = None
+        for chunk_start in range(start + 1, end, chunk_size):
+            chunk_end = min(chunk_start + chunk_size, end)
+            dists = _distances_to_segment(points(chunk_start, chunk_end), a, b)
+            max_idx = int(np.argmax(dists))
+            if dists[max_idx] > max_dist:
+                max_dist = dists[max_idx]
+                split = chunk_start + max_idx
+
+        # split there if it is too far away
+        if max_dist > tolerance:
+            stack.append((split, end))
+            stack.append((start, split))
+        else:
+            yield np.array([end], dtype=np.intp)
+
+    # finished
+    gpx2pln_profile.count("douglas_peucker_point_checks", num_checks)
+
+# area of the triangle between three points given as lists
+def _triangle_area(a, b, c):
+    u0, u1, u2 = a[0] - b[0], a[1] - b[1], a[2] - b[2]
+    v0, v1, v2 = c[0] - b[0], c[1] - b[1], c[2] - b[2]
+    x = u1 * v2 - u2 * v1
+    y = u2 * v0 - u0 * v2
+    z = u0 * v1 - u1 * v0
+    return 0.5 * math.sqrt(x * x + y * y + z * z)
+
+# indices of the points kept by the visvalingam-whyatt algorithm. points with the smallest effective area, i.e. the
+# area of the triangle with their two neighbours, are removed one after another until exactly num_points remain.
+# the first and the last point are always kept.
+def visvalingam_indices(lats, lons, num_points):
+    total_points = len(lats)
+    num_points = max(num_points, 2)
+    if total_points <= num_points:
+        return np.arange(total_points)
+    points = to_metric(lats, lons)
+
+    # doubly linked list of the remaining points. plain lists are faster than arrays for single elements.
+    prev_idx = list(range(-1, total_points - 1))
+    next_idx = list(range(1, total_points + 1))
+    point_list = points.tolist()
+
+    # effective areas of all inner points
+    areas = np.full(total_points, np.inf)
+    areas[1:-1] = 0.5 * np.linalg.norm(np.cross(points[:-2] - points[1:-1], points[2:] - points[1:-1]), axis=1)
+    areas = areas.tolist()
+    heap = [(areas[i], i) for i in range(1, total_points - 1)]
+    heapq.heapify(heap)
+
+    # remove points until the budget is reached
+    removed = [False] * total_points
+    num_remaining = total_points
+    heappop = heapq.heappop
+    heappush = heapq.heappush
+    while num_remaining > num_points:
+        area, idx = heappop(heap)
+        if removed[idx] or area != areas[idx]:
+            continue # outdated heap entry
+        removed[idx] = True
+        num_remaining -= 1
+
+        # unlink the point
+        left = prev_idx[idx]
+        right = next_idx[idx]
+        next_idx[left] = right
+        prev_idx[right] = left
+
+        # update the neighbours. their area never drops below the removed one so that the order of removal stays
+        # consistent.
+        for neighbour in (left, right):
+            if neighbour == 0 or neighbour == total_points - 1:
+                continue
+            new_area = max(area, _triangle_area(point_list[prev_idx[neighbour]], point_list[neighbour], point_list[next_idx[neighbour]]))
+            areas[neighbour] = new_area
+            heappush(heap, (new_area, neighbour))
+
+    # finished
+    gpx2pln_profile.count("visvalingam_removals", total_points - num_remaining)
+    return np.flatnonzero(np.logical_not(removed))
@@ -0,0 +1,106 @@
+import numpy as np
+import gpx2pln_geo
+
+# spatial indexing of geo-coordinates as points on the unit sphere. straight (chord) distances between those
+# points are cheap to compute and work with kd-trees. they are only used to find candidates, exact distances
+# are always computed with gpx2pln_geo afterwards.
+
+# geodesic distances on the wgs84 ellipsoid are never smaller than this fraction of the great circle distance
+# on the sphere with the mean earth radius. the real deviation is below one percent.
+DISTANCE_SAFETY_FACTOR = 0.98
+
+POLYLINE_BLOCK_SIZE = 64 # number of points sharing one bounding sphere in a polyline index
+
+# convert geo-coordinates to points on the unit sphere
+def to_xyz(lats, lons):
+    lats = np.radians(np.asarray(lats, dtype=np.float64))
+    lons = np.radians(np.asarray(lons, dtype=np.float64))
+    cos_lats = np.cos(lats)
+    return np.stack((cos_lats * np.cos(lons), cos_lats * np.sin(lons), np.sin(lats)), axis=-1)
+
+# chord on the unit sphere that contains all points within the given geodesic distance
+def chord_radius(dist):
+    angle = min(np.pi, dist / (gpx2pln_geo.EARTH_RADIUS * DISTANCE_SAFETY_FACTOR))
+    return 2.0 * np.sin(angle / 2.0)
+
+# smallest possible geodesic distance between points separated by the given chord on the unit sphere
+def chord_lower_bound(chord):
+    return DISTANCE_SAFETY_FACTOR * gpx2pln_geo.EARTH_RADIUS * np.maximum(chord, 0.0)
+
+# latitude/longitude boxes (min_lat, max_lat, min_lon, max_lon) that contain all points within the given
+# geodesic distance. boxes crossing the antimeridian are split in two.
+def bounding_boxes(lat, lon, dist):
+    angle = np.degrees(dist / (gpx2pln_geo.EARTH_RADIUS * DISTANCE_SAFETY_FACTOR))
+    min_lat = lat - angle
+    max_lat = lat + angle
+
+    # near the poles all longitudes are possible
+    if min_lat <= -90.0 or max_lat >= 90.0 or angle >= 90.0:
+        return [(max(min_lat, -90.0), min(max_lat, 90.0), -180.0, 180.0)]
+    ratio = np.sin(np.radians(angle)) / np.cos(np.radians(lat))
+    if ratio >= 1.0:
+        return [(min_lat, max_lat, -180.0, 180.0)]
+    delta_lon = np.degrees(np.arcsin(ratio))
+    min_lon = lon - delta_lon
+    max_lon = lon + delta_lon
+
+    # split at the antimeridian
+    if min_lon < -180.0:
+        return [(min_lat, max_lat, min_lon + 360.0, 180.0), (min_lat, max_lat, -180.0, max_lon)]
+    if max_lon > 180.0:
+        return [(min_lat, max_lat, min_lon, 180.0), (min_lat, max_lat, -180.0, max_lon - 360.0)]
+    return [(min_lat, max_lat, min_lon, max_lon)]
+
+# index over an incrementally growing set of track points. points are grouped into blocks with bounding spheres
+# so that blocks that are too far away can be skipped without looking at their points.
+class PolylineIndex:
+    def __init__(self):
+        self.__blockLats = list()
+        self.__blockLons = list()
+        self.__centers = np.empty((0,3), dtype=np.float64)
+        self.__radii = np.empty(0, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.__blockLats)
+
+    def add(self, lats, lons):
+        # split into blocks
+        centers = list()
+        radii = list()
+        for start in range(0, len(lats), POLYLINE_BLOCK_SIZE):
+            block_lats = lats[start:start+POLYLINE_BLOCK_SIZE]
+            block_lons = lons[start:start+POLYLINE_BLOCK_SIZE]
+            xyz = to_xyz(block_lats, block_lons)
+            center = np.mean(xyz, axis=0)
+            self.__blockLats.append(block_lats)
+            self.__blockLons.append(block_lons)
+            centers.append(center)
+            radii.append(np.max(np.linalg.norm(xyz - center, axis=1)))
+
+        # extend the bounding spheres
+        if len(centers) > 0:
+            self.__centers = np.concatenate([self.__centers, np.array(centers)])
+            self.__radii = np.concatenate([self.__radii, np.array(radii)])
+
+    def minimal_distance(self, lat, lon, start_block=0, upper=np.inf):
+        # exact minimal geodesic distance between one point and the points in the blocks starting with start_block.
+        # returns upper if no point is closer than that.
+        if start_block >= len(self):
+            return upper
+
+        # lower bounds of the distance to every block
+        xyz = to_xyz(lat, lon)
+        chords = np.linalg.norm(self.__centers[start_block:] - xyz, axis=1) - self.__radii[start_block:]
+        bounds = chord_lower_bound(chords)
+
+        # check the blocks nearest first until no block can be closer
+        min_dist = upper
+        for i in np.argsort(bounds, kind="stable"):
+            if bounds[i] >= min_dist:
+                break
+            block = start_block + int(i)
+            dist = gpx2pln_geo.minimal_distance(lat, lon, self.__blockLats[block], self.__blockLons[block])
+            min_dist = min(min_dist, dist)
+
+        # finished
+        return min_dist
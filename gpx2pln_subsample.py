@@ -1,49 +1,115 @@
-import LatLon23
+import numpy as np
+import gpx2pln_geo
+import gpx2pln_legs
 
 MINIMUM_DISTANCE_BETWEEN_POINTS = 0.1 # in kilometers
+MIN_FILTER_BLOCK_SIZE = 4 # number of points checked at once when removing near points, doubled while all are near
+MAX_FILTER_BLOCK_SIZE = 1024
+FILTER_WINDOW_SIZE = 65536 # points whose distances along the track are known at once
+PATH_LENGTH_TOLERANCE = 1e-9 # relative, for rounding the distances along the track
+
+def _iter_near_points_filtered(lats, lons):
+    # indices of the points that are further away from the last chosen point than the minimum distance. the
+    # distances along the track are known for a window of points: the next point is chosen right away if it follows
+    # a chosen point and is far enough away, and points are skipped as long as even the path along the track from
+    # the last chosen point is not longer than the minimum distance. the remaining points are checked in blocks that
+    # grow while all of their points are near.
+    num_points = len(lats)
+    last_idx = 0
+    yield last_idx
+    if num_points < 2:
+        return
+    def window(start):
+        segments = gpx2pln_geo.segment_distances(lats[start:start+FILTER_WINDOW_SIZE], lons[start:start+FILTER_WINDOW_SIZE])
+        return start, start + len(segments) + 1, segments, np.concatenate(([0.0], np.cumsum(segments)))
+    win_start, win_end, segments, path = window(0)
+    path_offset = 0.0 # path length from the last chosen point to the start of the window
+    min_path = MINIMUM_DISTANCE_BETWEEN_POINTS * (1.0 - PATH_LENGTH_TOLERANCE)
+    cur_idx = 1
+    block_size = MIN_FILTER_BLOCK_SIZE
+    while cur_idx < num_points:
+        # the window ends with the current point, continue with the next one
+        if cur_idx == win_end:
+            path_offset += path[-1]
+            win_start, win_end, segments, path = window(cur_idx - 1)
+            continue
+
+        # the following points are chosen as long as they are far enough away from their predecessor
+        if cur_idx == last_idx + 1 and segments[last_idx - win_start] > MINIMUM_DISTANCE_BETWEEN_POINTS:
+            near = np.flatnonzero(segments[last_idx-win_start:] <= MINIMUM_DISTANCE_BETWEEN_POINTS)
+            end_idx = win_end if len(near) == 0 else last_idx + int(near[0]) + 1
+            yield from range(cur_idx, end_idx)
+            last_idx = end_idx - 1
+            path_offset = -path[last_idx - win_start]
+            cur_idx = end_idx
+            block_size = MIN_FILTER_BLOCK_SIZE
+            continue
+
+        # skip the points that are near because even the path along the track is short enough
+        skip_idx = win_start + int(np.searchsorted(path, min_path - path_offset, side="right"))
+        if skip_idx > cur_idx:
+            cur_idx = min(skip_idx, win_end)
+            continue
+
+        # check the distances from the last chosen point
+        end_idx = min(cur_idx + block_size, win_end)
+        dists = gpx2pln_geo.distance(lats[last_idx], lons[last_idx], lats[cur_idx:end_idx], lons[cur_idx:end_idx])
+        far = np.flatnonzero(dists > MINIMUM_DISTANCE_BETWEEN_POINTS)
+        if len(far) == 0:
+            cur_idx = end_idx
+            block_size = min(2 * block_size, MAX_FILTER_BLOCK_SIZE)
+        else:
+            last_idx = cur_idx + int(far[0])
+            yield last_idx
+            path_offset = -path[last_idx - win_start]
+            cur_idx = last_idx + 1
+            block_size = MIN_FILTER_BLOCK_SIZE
+
+def _filter_near_points(lats, lons):
+    return list(_iter_near_points_filtered(lats, lons))
+
+def split_legs(track, max_leg_length):
+    lats = track.get_lats()
+    lons = track.get_lons()
 
-def subsample(coords, max_leg_length, num_leg_points):
     # remove points that are too near to each other
-    filtered_coords = [coords[0]]
-    last_coord = coords[0]
-    for c in coords[1:]:
-        if last_coord.distance(c) > MINIMUM_DISTANCE_BETWEEN_POINTS:
-            filtered_coords.append(c)
-            last_coord = c
-    if last_coord != coords[-1]:
-        filtered_coords.append(coords[-1])
-    coords = filtered_coords
+    filtered_idx = _filter_near_points(lats, lons)
+    last_idx = len(track) - 1
+    if lats[filtered_idx[-1]] != lats[last_idx] or lons[filtered_idx[-1]] != lons[last_idx]:
+        filtered_idx.append(last_idx)
+    track = track.take(filtered_idx)
 
     # split the track into legs if requested
-    raw_legs = [coords]
-    if not max_leg_length is None:
-        assert type(coords[0]) == LatLon23.LatLon
-        raw_legs = list()
-        cur_leg = [coords[0]]
-        cur_len = 0.0
-        for c in coords[1:]:
-            assert type(c) == LatLon23.LatLon
-            cur_len += c.distance(cur_leg[-1])
-            cur_leg.append(c)
-            if cur_len > max_leg_length:
-                raw_legs.append(cur_leg)
-                cur_leg = [c]
-                cur_len = 0.0
-        if len(cur_leg) > 1:
-            raw_legs.append(cur_leg)
-    
-    # subsample the legs
+    ranges = gpx2pln_legs.leg_ranges(gpx2pln_geo.cumulative_distance(track.get_lats(), track.get_lons()), max_leg_length)
+    return track, ranges
+
+def iter_leg_indices(track, max_leg_length, chunk_size):
+    # indices of the points of the same legs as split_legs(), handed out as soon as the legs are complete. the points
+    # are filtered while going along the track, so it can also be memory-mapped.
+    lats = track.get_lats()
+    lons = track.get_lons()
+    def index_blocks():
+        block = list()
+        last_idx = 0
+        for idx in _iter_near_points_filtered(lats, lons):
+            block.append(idx)
+            last_idx = idx
+            if len(block) >= chunk_size:
+                yield np.array(block, dtype=np.intp)
+                block = list()
+        if lats[last_idx] != lats[len(track)-1] or lons[last_idx] != lons[len(track)-1]:
+            block.append(len(track) - 1)
+        if len(block) > 0:
+            yield np.array(block, dtype=np.intp)
+    return gpx2pln_legs.iter_leg_indices(lats, lons, index_blocks(), max_leg_length)
+
+def iter_legs(track, max_leg_length, chunk_size):
+    for indices in iter_leg_indices(track, max_leg_length, chunk_size):
+        yield track.take(indices)
+
+def subsample_leg(leg, num_leg_points):
+    # waypoints at fixed spacing between the first and the last point
     num_intermediate = num_leg_points - 2
-    legs = list()
-    for raw in raw_legs:
-        num_raw = len(raw)
-        spacing = int(num_raw / (num_intermediate+1))
-        cur_leg = [raw[0]]
-        for i in range(num_intermediate):
-            idx = (i+1) * spacing
-            cur_leg.append(raw[idx])
-        cur_leg.append(raw[-1])
-        legs.append(cur_leg)
-    
-    # finished
-    return legs
+    spacing = int(len(leg) / (num_intermediate+1))
+    indices = np.concatenate(([0], np.arange(1, num_intermediate+1) * spacing, [len(leg)-1]))
+    return leg.take(indices)
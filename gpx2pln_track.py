@@ -0,0 +1,135 @@
+import numpy as np
+
+# compact representation of a track. coordinates are stored as contiguous float64 arrays in degree.
+# elevation (in the unit of the gpx file) and time (seconds since the epoch) are optional and nan where unknown.
+class Track:
+    def __init__(self, lats, lons, elevations=None, times=None):
+        # save the coordinates
+        self.__lats = np.ascontiguousarray(lats, dtype=np.float64)
+        self.__lons = np.ascontiguousarray(lons, dtype=np.float64)
+        assert self.__lats.ndim == 1 and self.__lats.shape == self.__lons.shape
+
+        # save the optional values
+        self.__elevations = None
+        if not elevations is None:
+            self.__elevations = np.ascontiguousarray(elevations, dtype=np.float64)
+            assert self.__elevations.shape == self.__lats.shape
+        self.__times = None
+        if not times is None:
+            self.__times = np.ascontiguousarray(times, dtype=np.float64)
+            assert self.__times.shape == self.__lats.shape
+
+    def __len__(self):
+        return self.__lats.shape[0]
+
+    def __getitem__(self, key):
+        # only slices are supported. they return views on the same memory.
+        assert type(key) == slice
+        elevations = None if self.__elevations is None else self.__elevations[key]
+        times = None if self.__times is None else self.__times[key]
+        return Track(self.__lats[key], self.__lons[key], elevations, times)
+
+    def get_lats(self):
+        return self.__lats
+
+    def get_lons(self):
+        return self.__lons
+
+    def get_elevations(self):
+        return self.__elevations
+
+    def get_times(self):
+        return self.__times
+
+    def get_max_elevation(self):
+        # none if unknown. never below zero.
+        if self.__elevations is None or np.all(np.isnan(self.__elevations)):
+            return None
+        return max(0.0, float(np.nanmax(self.__elevations)))
+
+    def take(self, indices):
+        # new track with copies of the selected points
+        indices = np.asarray(indices, dtype=np.intp)
+        elevations = None if self.__elevations is None else self.__elevations[indices]
+        times = None if self.__times is None else self.__times[indices]
+        return Track(self.__lats[indices], self.__lons[indices], elevations, times)
+
+    def reverse(self):
+        self.__lats = np.ascontiguousarray(self.__lats[::-1])
+        self.__lons = np.ascontiguousarray(self.__lons[::-1])
+        if not self.__elevations is None:
+            self.__elevations = np.ascontiguousarray(self.__elevations[::-1])
+        if not self.__times is None:
+            self.__times = np.ascontiguousarray(self.__times[::-1])
+
+# concatenate multiple tracks into a new one
+def concatenate(tracks):
+    assert len(tracks) > 0
+    lats = np.concatenate([x.get_lats() for x in tracks])
+    lons = np.concatenate([x.get_lons() for x in tracks])
+
+    # keep the optional values if at least one track has them
+    elevations = None
+    if any(not x.get_elevations() is None for x in tracks):
+        elevations = np.concatenate([np.full(len(x), np.nan) if x.get_elevations() is None else x.get_elevations() for x in tracks])
+    times = None
+    if any(not x.get_times() is None for x in tracks):
+        times = np.concatenate([np.full(len(x), np.nan) if x.get_times() is None else x.get_times() for x in tracks])
+
+    # finished
+    return Track(lats, lons, elevations, times)
+
+# write the arrays of a track to a raw file. returns a small descriptor for load_from_file().
+def save_to_file(track, fname):
+    columns = [track.get_lats(), track.get_lons()]
+    has_elevations = not track.get_elevations() is None
+    if has_elevations:
+        columns.append(track.get_elevations())
+    has_times = not track.get_times() is None
+    if has_times:
+        columns.append(track.get_times())
+    with open(fname, "wb") as fd:
+        for values in columns:
+            np.ascontiguousarray(values, dtype="<f8").tofile(fd)
+    return (fname, len(track), has_elevations, has_times)
+
+# writes a track piece by piece, one raw file per column, so that it never has to be in memory at once. missing
+# optional values are written as nan. finish() memory-maps the result like load_from_file().
+class TrackWriter:
+    def __init__(self, fname, has_elevations, has_times):
+        self.__fnames = ["%s.%s" % (fname, x) for x in ["lats", "lons"] + ["elevations"] * has_elevations + ["times"] * has_times]
+        self.__fds = [open(x, "wb") for x in self.__fnames]
+        self.__hasElevations = has_elevations
+        self.__hasTimes = has_times
+        self.__numPoints = 0
+
+    def append(self, track):
+        columns = [track.get_lats(), track.get_lons()]
+        if self.__hasElevations:
+            columns.append(np.full(len(track), np.nan) if track.get_elevations() is None else track.get_elevations())
+        if self.__hasTimes:
+            columns.append(np.full(len(track), np.nan) if track.get_times() is None else track.get_times())
+        for fd, values in zip(self.__fds, columns):
+            np.ascontiguousarray(values, dtype="<f8").tofile(fd)
+        self.__numPoints += len(track)
+
+    def finish(self):
+        for fd in self.__fds:
+            fd.close()
+        if self.__numPoints == 0:
+            return Track(np.empty(0), np.empty(0))
+        columns = [np.memmap(x, dtype="<f8", mode="r", shape=(self.__numPoints,)) for x in self.__fnames]
+        elevations = columns[2] if self.__hasElevations else None
+        times = columns[-1] if self.__hasTimes else None
+        return Track(columns[0], columns[1], elevations, times)
+
+# memory-map a track written by save_to_file(). the arrays are read-only.
+def load_from_file(descriptor):
+    fname, num_points, has_elevations, has_times = descriptor
+    if num_points == 0:
+        return Track(np.empty(0), np.empty(0))
+    num_columns = 2 + int(has_elevations) + int(has_times)
+    columns = np.memmap(fname, dtype="<f8", mode="r", shape=(num_columns, num_points))
+    elevations = columns[2] if has_elevations else None
+    times = columns[num_columns-1] if has_times else None
+    return Track(columns[0], columns[1], elevations, times)
@@ -0,0 +1,23 @@
+import numpy as np
+import gpx2pln_geo
+import gpx2pln_legs
+import gpx2pln_simplify
+
+def split_legs(track, max_leg_length):
+    # split into legs along the full track
+    ranges = gpx2pln_legs.leg_ranges(gpx2pln_geo.cumulative_distance(track.get_lats(), track.get_lons()), max_leg_length)
+    return track, ranges
+
+def iter_leg_indices(track, max_leg_length, chunk_size):
+    # indices of the points of the same legs as split_legs(), handed out as soon as the legs are complete. works on
+    # memory-mapped tracks as well.
+    index_blocks = (np.arange(x, min(x + chunk_size, len(track))) for x in range(0, len(track), chunk_size))
+    return gpx2pln_legs.iter_leg_indices(track.get_lats(), track.get_lons(), index_blocks, max_leg_length)
+
+def iter_legs(track, max_leg_length, chunk_size):
+    for indices in iter_leg_indices(track, max_leg_length, chunk_size):
+        yield track.take(indices)
+
+def visvalingam_leg(leg, num_leg_points):
+    # simplify the leg to the requested number of waypoints
+    return leg.take(gpx2pln_simplify.visvalingam_indices(leg.get_lats(), leg.get_lons(), num_leg_points))